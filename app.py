@@ -4,9 +4,11 @@ import os
 import sys
 from pathlib import Path
 import tempfile
+import hashlib
 
 # Add src to path
 sys.path.append(str(Path(__file__).parent / "src"))
+from config import config
 
 # Set page config first
 st.set_page_config(
@@ -39,21 +41,31 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'vector_store' not in st.session_state:
-    st.session_state.vector_store = None
+# Initialize session state (models and collections are shared process-wide
+# through resource_registry; the session only keeps the collection name)
 if 'documents_processed' not in st.session_state:
     st.session_state.documents_processed = False
-if 'embedding_model' not in st.session_state:
-    st.session_state.embedding_model = None
 if 'qa_history' not in st.session_state:
     st.session_state.qa_history = []
 
+
+def get_store(name: str):
+    """Fetch a collection through the shared manager on every use.
+    
+    Never keep the result across reruns: the manager may evict the store,
+    and an evicted instance rejects writes.
+    """
+    from resource_registry import get_collections
+    return get_collections(config).get(name)
+
 # Sidebar
 with st.sidebar:
     st.markdown("# 📚 RAG Document QA")
     st.markdown("---")
     
+    # Collection selection (each collection is a separate store on disk)
+    collection_name = st.text_input("Collection", value=config.COLLECTION_NAME)
+    
     # Document upload
     uploaded_files = st.file_uploader(
         "Upload PDF Documents",
@@ -72,8 +84,8 @@ with st.sidebar:
                     try:
                         from document_processor import DocumentProcessor
                         from intelligent_chunker import IntelligentChunker
-                        from embeddings import EmbeddingGenerator
-                        from vector_store import SimpleVectorStore
+                        from resource_registry import registry, get_embedding_model
+                        from config import config
                     except ImportError as e:
                         st.error(f"Import error: {e}")
                         st.stop()
@@ -91,6 +103,10 @@ with st.sidebar:
                         try:
                             if processor.validate_pdf(temp_path):
                                 pages = processor.extract_text_with_metadata(temp_path)
+                                # Identify documents by upload name and content, not temp path
+                                doc_hash = hashlib.md5(uploaded_file.getbuffer()).hexdigest()[:8]
+                                for _, page_meta in pages:
+                                    page_meta.update({"source": uploaded_file.name, "doc_hash": doc_hash})
                                 all_pages.extend(pages)
                                 st.sidebar.success(f"✓ {uploaded_file.name}: {len(pages)} pages")
                         finally:
@@ -106,24 +122,30 @@ with st.sidebar:
                     chunker = IntelligentChunker(chunk_size=1000, chunk_overlap=200)
                     all_chunks = chunker.chunk_document(all_pages)
                     
-                    # Generate embeddings (without torch to avoid DLL issues)
-                    embedding_gen = EmbeddingGenerator(use_torch=False)  # Use TF-IDF
-                    embeddings, metadatas = embedding_gen.generate_embeddings(all_chunks)
-                    st.session_state.embedding_model = embedding_gen
-                    
-                    # Create vector store
-                    vector_store = SimpleVectorStore()
-                    vector_store.create_collection()
+                    # Shared embedding model (without torch to avoid DLL issues)
+                    embedding_gen = get_embedding_model(config)
+                    cache = embedding_gen.cache
                     
-                    # Add to vector store
-                    chunk_texts = [chunk[0] for chunk in all_chunks]
-                    vector_store.add_documents(embeddings, metadatas, chunk_texts)
+                    # Other sessions may write to the same collection
+                    with registry.writer(("collection", collection_name)):
+                        # Re-uploaded files replace their previous version
+                        vector_store = get_store(collection_name)
+                        for uploaded_file in uploaded_files:
+                            for doc_hash in vector_store.doc_hashes(uploaded_file.name):
+                                vector_store.delete(doc_hash)
+                        
+                        # Stream embeddings into the store batch by batch, fetching
+                        # the store per batch in case the manager evicted it meanwhile
+                        vector_store.reserve(len(all_chunks), embedding_gen.dimension)
+                        for embeddings, metadatas, chunk_texts in embedding_gen.iter_embeddings(all_chunks):
+                            get_store(collection_name).add_documents(embeddings, metadatas, chunk_texts,
+                                                                     model_id=embedding_gen.model_id)
                     
                     # Update session state
-                    st.session_state.vector_store = vector_store
                     st.session_state.documents_processed = True
                     
                     st.success(f"✅ Processed {len(all_pages)} pages into {len(all_chunks)} chunks")
+                    st.caption(f"Embedding cache hit rate: {cache.hit_rate:.0%}")
                     
                 except Exception as e:
                     st.error(f"Error processing documents: {str(e)}")
@@ -139,18 +161,12 @@ with st.sidebar:
         
         # Create a demo vector store with sample data
         try:
-            from vector_store import SimpleVectorStore
-            from embeddings import EmbeddingGenerator
-            import numpy as np
+            from resource_registry import get_embedding_model
+            from config import config
             
-            # Create demo embeddings
-            embedding_gen = EmbeddingGenerator(use_torch=False)
-            st.session_state.embedding_model = embedding_gen
-            
-            # Create demo store
-            demo_store = SimpleVectorStore()
-            demo_store.create_collection()
-            st.session_state.vector_store = demo_store
+            # Load the shared model and demo store
+            get_embedding_model(config)
+            get_store(collection_name)
         except Exception as e:
             st.error(f"Error setting up demo: {e}")
         
@@ -159,8 +175,26 @@ with st.sidebar:
     st.markdown("---")
     
     # Database controls
+    if st.session_state.documents_processed:
+        indexed_sources = get_store(collection_name).sources()
+        if indexed_sources:
+            doc_to_remove = st.selectbox("Indexed documents", indexed_sources, key="doc_to_remove")
+            if st.button("➖ Remove Document", type="secondary", use_container_width=True):
+                from resource_registry import registry
+                with registry.writer(("collection", collection_name)):
+                    store = get_store(collection_name)
+                    for doc_hash in store.doc_hashes(doc_to_remove):
+                        store.delete(doc_hash)
+                st.success(f"Removed {doc_to_remove}")
+                st.rerun()
+    
+    # Memory held by the shared resources of this server process
+    with st.expander("Shared resources"):
+        from resource_registry import registry
+        for name, size in registry.memory_usage().items():
+            st.caption(f"{name}: {size / 1e6:.1f} MB")
+    
     if st.button("🗑️ Clear Database", type="secondary", use_container_width=True):
-        st.session_state.vector_store = None
         st.session_state.documents_processed = False
         st.session_state.qa_history = []
         st.success("Database cleared!")
@@ -195,32 +229,58 @@ question = st.text_input(
     key="question_input"
 )
 
-if question and st.session_state.vector_store:
+# Optional scope: restrict search to a single document
+scope_options = ["All documents"]
+if st.session_state.documents_processed:
+    scope_options += get_store(collection_name).sources()
+scope = st.selectbox("Search in:", scope_options, key="search_scope")
+search_mode = st.radio("Search mode:", ["Semantic", "Keyword", "Hybrid"], horizontal=True, key="search_mode")
+
+if question and st.session_state.documents_processed:
     with st.spinner("🔍 Searching documents..."):
         try:
             # Import modules
             try:
-                from embeddings import EmbeddingGenerator
-                from vector_store import SimpleVectorStore
+                from resource_registry import get_embedding_model, get_reranker
+                from config import config
                 from llm_handler import LLMHandler
                 from confidence_scorer import ConfidenceScorer
             except ImportError as e:
                 st.error(f"Import error: {e}")
                 st.stop()
             
-            # Get embedding model
-            if st.session_state.embedding_model:
-                embedding_gen = st.session_state.embedding_model
-            else:
-                embedding_gen = EmbeddingGenerator(use_torch=False)
-                st.session_state.embedding_model = embedding_gen
+            # Get the shared embedding model
+            embedding_gen = get_embedding_model(config)
             
             # Generate query embedding
             query_embedding = embedding_gen.embed_query(question)
             
             # Search in vector store
-            vector_store = st.session_state.vector_store
-            documents, metadatas, scores = vector_store.similarity_search(query_embedding, k=5)
+            # Fetch through the manager in case the collection was evicted
+            vector_store = get_store(collection_name)
+            search_filter = None if scope == "All documents" else {"source": scope}
+            if search_mode != "Keyword":
+                # Query vectors must come from the model that embedded the collection
+                vector_store.check_model(embedding_gen.model_id, embedding_gen.dimension)
+            # With reranking, fetch a wider pool and keep the best 5 after the rerank
+            n_results = config.RERANK_CANDIDATES if config.RERANK else 5
+            if search_mode == "Keyword":
+                documents, metadatas, scores = vector_store.lexical_search(
+                    question, k=n_results, filter=search_filter
+                )
+            elif search_mode == "Hybrid":
+                documents, metadatas, scores = vector_store.hybrid_search(
+                    question, query_embedding, k=n_results, filter=search_filter
+                )
+            else:
+                documents, metadatas, scores = vector_store.similarity_search(
+                    query_embedding, k=n_results, filter=search_filter
+                )
+            if config.RERANK:
+                documents, metadatas, scores = get_reranker(config).rerank(
+                    question, documents, metadatas, scores
+                )
+                documents, metadatas, scores = documents[:5], metadatas[:5], scores[:5]
             
             if not documents:
                 st.warning("❌ No relevant information found in the documents.")
@@ -365,7 +425,7 @@ if st.session_state.qa_history:
 st.markdown("---")
 st.markdown("""
 <div style="text-align: center; color: #6B7280; padding: 1rem;">
-    <small>Built with Streamlit • FAISS • TF-IDF Embeddings</small><br>
+    <small>Built with Streamlit • FAISS • Hashed Term Embeddings</small><br>
     <small>Dynamic RAG with Hallucination Prevention</small>
 </div>
 """, unsafe_allow_html=True)
\ No newline at end of file
@@ -0,0 +1,64 @@
+# benchmark_embeddings.py
+"""
+Cold start and throughput of the EmbeddingGenerator backends.
+
+    python benchmark_embeddings.py
+"""
+import sys
+import time
+import subprocess
+import numpy as np
+
+from embeddings import EmbeddingGenerator
+
+BACKENDS = {
+    "torch": dict(use_torch=True),
+    "onnx": dict(backend="onnx"),
+    "onnx-int8": dict(backend="onnx", onnx_quantize=True),
+}
+
+COLD_START = """
+import time
+start = time.perf_counter()
+from embeddings import EmbeddingGenerator
+EmbeddingGenerator(query_cache_size=0, **{kwargs}).embed_query("cold start")
+print(time.perf_counter() - start)
+"""
+
+
+def sample_texts(n: int = 2000, seed: int = 0):
+    """Sentences of varied length built from a small vocabulary"""
+    rng = np.random.default_rng(seed)
+    words = ("the report covers revenue growth risk policy customer data model training "
+             "quarter market energy solar battery contract deadline payment invoice").split()
+    return [" ".join(rng.choice(words, rng.integers(8, 120))) for _ in range(n)]
+
+
+def cold_start_seconds(kwargs: dict) -> float:
+    """Import + load + first query in a fresh interpreter"""
+    out = subprocess.run([sys.executable, "-c", COLD_START.format(kwargs=kwargs)],
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def benchmark_backends(texts):
+    print(f"\nBackends: {len(texts)} texts")
+    print(f"{'backend':>10} {'cold start s':>13} {'chunks/sec':>11} {'min cos vs torch':>17}")
+    reference = None
+    for name, kwargs in BACKENDS.items():
+        generator = EmbeddingGenerator(**kwargs)
+        if not hasattr(generator.model, "encode"):
+            print(f"{name:>10}   (not available)")
+            continue
+        generator.generate_embeddings([(t, {}) for t in texts[:32]])  # warm-up
+        start = time.perf_counter()
+        embeddings, _ = generator.generate_embeddings([(t, {}) for t in texts])
+        rate = len(texts) / (time.perf_counter() - start)
+        if reference is None:
+            reference = embeddings
+        agreement = float(np.min(np.sum(embeddings * reference, axis=1)))
+        print(f"{name:>10} {cold_start_seconds(kwargs):>13.2f} {rate:>11.0f} {agreement:>17.4f}")
+
+
+if __name__ == "__main__":
+    benchmark_backends(sample_texts())
@@ -0,0 +1,137 @@
+# benchmark_vector_store.py
+"""
+Benchmarks for SimpleVectorStore search options.
+
+    python benchmark_vector_store.py                 # synthetic corpus
+    python benchmark_vector_store.py ./vector_db     # rows of an existing store
+"""
+import sys
+import time
+import tempfile
+import numpy as np
+
+from vector_store import SimpleVectorStore
+from quantization import recall_at_k
+
+
+def synthetic_corpus(n_rows: int = 50000, dimension: int = 384, n_topics: int = 200,
+                     seed: int = 0) -> np.ndarray:
+    """Clustered random vectors, closer to real embeddings than pure noise"""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dimension))
+    vectors = topics[rng.integers(0, n_topics, n_rows)] + 0.7 * rng.standard_normal((n_rows, dimension))
+    return vectors.astype(np.float32)
+
+
+def load_corpus(persist_dir: str) -> np.ndarray:
+    """All rows of an existing store"""
+    store = SimpleVectorStore(persist_dir)
+    return np.vstack([block for _, block in store._blocks()])
+
+
+def make_queries(vectors: np.ndarray, n_queries: int = 200, seed: int = 1) -> np.ndarray:
+    """Perturbed copies of random corpus rows"""
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.integers(0, len(vectors), n_queries)]
+    return picked + 0.3 * picked.std() * rng.standard_normal(picked.shape).astype(np.float32)
+
+
+def build_store(vectors: np.ndarray, **store_kwargs) -> SimpleVectorStore:
+    store = SimpleVectorStore(tempfile.mkdtemp(), **store_kwargs)
+    store.add_documents(vectors, [{"chunk_id": i} for i in range(len(vectors))],
+                        [str(i) for i in range(len(vectors))])
+    return store
+
+
+def search_ids(store: SimpleVectorStore, queries: np.ndarray, k: int):
+    """Run a warm-up query, then time the batch; returns (ids, ms per query)"""
+    store.similarity_search(queries[0], k=k)
+    start = time.perf_counter()
+    results = store.similarity_search_batch(queries, k=k)
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return [[int(doc) for doc in documents] for documents, _, _ in results], elapsed_ms
+
+
+def benchmark_quantization(vectors: np.ndarray, queries: np.ndarray, k: int = 10):
+    """Recall@k, latency and code memory of int8 / PQ against exact float32.
+    
+    A compressed scan only pays off when it is faster than the exact one, so
+    modes that are slower are called out below the table.
+    """
+    print(f"\nQuantization: {len(vectors)} rows x {vectors.shape[1]} dims, "
+          f"{len(queries)} queries, k={k}")
+    print(f"{'mode':<12}{'recall@k':>10}{'ms/query':>10}{'vs exact':>10}{'scan MB':>10}")
+
+    exact_ids, exact_ms = search_ids(build_store(vectors), queries, k)
+    print(f"{'float32':<12}{1.0:>10.3f}{exact_ms:>10.2f}{1.0:>9.2f}x"
+          f"{vectors.shape[1] * 4 * len(vectors) / 1e6:>10.1f}")
+
+    slower = []
+    for quantization in ["int8", "pq"]:
+        store = build_store(vectors, quantization=quantization)
+        start = time.perf_counter()
+        store.wait_for_index()  # codes are trained and encoded in the background
+        print(f"{quantization + ' build':<12}{'':>10}{(time.perf_counter() - start) * 1000:>10.1f}"
+              f" ms in the background (exact search meanwhile)")
+        for rerank_factor in [1, 4, 10]:
+            store.rerank_factor = rerank_factor
+            ids, ms = search_ids(store, queries, k)
+            label = f"{quantization} x{rerank_factor}"
+            print(f"{label:<12}{recall_at_k(exact_ids, ids):>10.3f}{ms:>10.2f}{exact_ms / ms:>9.2f}x"
+                  f"{store.quantized.nbytes / 1e6:>10.1f}")
+            if ms > exact_ms:
+                slower.append(f"{label} ({ms:.1f} ms)")
+
+        # Reopening loads the saved quantizer and codes instead of retraining
+        start = time.perf_counter()
+        SimpleVectorStore(store.persist_dir, quantization=quantization).wait_for_index()
+        print(f"{quantization + ' reopen':<12}{'':>10}{(time.perf_counter() - start) * 1000:>10.1f}"
+              f" ms until the codes are loaded")
+
+    if slower:
+        print(f"⚠️ Slower than the exact scan ({exact_ms:.1f} ms): {', '.join(slower)}")
+
+
+def benchmark_precision(vectors: np.ndarray, queries: np.ndarray, k: int = 10):
+    """Recall@k, latency and memory of float16 row storage against float32"""
+    print(f"\nStorage precision: {len(vectors)} rows x {vectors.shape[1]} dims, k={k}")
+    print(f"{'dtype':<12}{'recall@k':>10}{'ms/query':>10}{'rows MB':>10}")
+
+    exact_ids = None
+    for dtype in ["float32", "float16"]:
+        # Reopen so rows are memory-mapped from disk, as in a restarted app
+        store = SimpleVectorStore(build_store(vectors, dtype=dtype).persist_dir)
+        ids, ms = search_ids(store, queries, k)
+        exact_ids = exact_ids or ids
+        print(f"{dtype:<12}{recall_at_k(exact_ids, ids):>10.3f}{ms:>10.2f}"
+              f"{store.memory_usage()['embeddings'] / 1e6:>10.1f}")
+
+
+def benchmark_sharding(vectors: np.ndarray, queries: np.ndarray, k: int = 10,
+                       shard_counts=(1, 2, 4, 8, 16, 32)):
+    """Single-query latency of exact search as the shard count grows"""
+    print(f"\nSharding: {len(vectors)} rows x {vectors.shape[1]} dims, k={k}")
+    print(f"{'shards':<8}{'ms/query':>10}{'speedup':>10}{'same hits':>11}")
+
+    persist_dir = build_store(vectors).persist_dir
+    baseline_ms, baseline_ids = None, None
+    for n_shards in shard_counts:
+        store = SimpleVectorStore(persist_dir, n_shards=n_shards)
+        store.similarity_search(queries[0], k=k)  # start the workers
+        start = time.perf_counter()
+        ids = [[int(doc) for doc in store.similarity_search(query, k=k)[0]] for query in queries]
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        store.close()
+
+        if baseline_ms is None:
+            baseline_ms, baseline_ids = elapsed_ms, ids
+        print(f"{n_shards:<8}{elapsed_ms:>10.2f}{baseline_ms / elapsed_ms:>10.2f}"
+              f"{str(ids == baseline_ids):>11}")
+
+
+if __name__ == "__main__":
+    corpus = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else synthetic_corpus()
+    queries = make_queries(corpus)
+    benchmark_quantization(corpus, queries)
+    benchmark_precision(corpus, queries)
+    benchmark_sharding(corpus, queries[:50])
@@ -0,0 +1,188 @@
+# src/chunk_store.py - COMPRESSED, LAZILY LOADED CHUNK TEXT AND METADATA
+import os
+import sys
+import json
+import zlib
+import bisect
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Union
+
+# Chunks per compressed block: big enough to compress well, small enough
+# that fetching one hit does not decompress much unrelated text
+BLOCK_CHUNKS = 32
+
+# np.load parses .npy headers with ast.literal_eval, which raises SystemError
+# when threads run it concurrently on Python < 3.11.9 (gh-106905); stores
+# load files from background index builds, so every np.load takes this lock
+NPY_LOAD_LOCK = threading.Lock()
+
+
+def write_chunk_blocks(path: str, index_path: str, chunks: List[str]):
+    """
+    Write chunk texts as zlib-compressed blocks of BLOCK_CHUNKS JSON strings.
+
+    The index file holds [BLOCK_CHUNKS, offset_0, ..., offset_n] as int64,
+    where block i spans bytes offset_i..offset_{i+1} of the data file.
+    """
+    offsets = [0]
+    with open(path, "wb") as f:
+        for start in range(0, len(chunks), BLOCK_CHUNKS):
+            block = zlib.compress(json.dumps(chunks[start:start + BLOCK_CHUNKS]).encode("utf-8"))
+            f.write(block)
+            offsets.append(offsets[-1] + len(block))
+    np.array([BLOCK_CHUNKS] + offsets, dtype=np.int64).tofile(index_path)
+
+
+class ChunkBlockFile:
+    """Random access to one segment's compressed chunk blocks"""
+
+    def __init__(self, path: str, index_path: str, n_chunks: int):
+        self.path = path
+        self.n_chunks = n_chunks
+        index = np.fromfile(index_path, dtype=np.int64)
+        self.block_chunks = int(index[0])
+        self.offsets = index[1:]
+
+    def __len__(self):
+        return self.n_chunks
+
+    def read_block(self, block: int) -> List[str]:
+        start, end = int(self.offsets[block]), int(self.offsets[block + 1])
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return json.loads(zlib.decompress(f.read(end - start)).decode("utf-8"))
+
+
+def write_json_lines(path: str, offsets_path: str, records: List[Dict]):
+    """Write one JSON record per line, plus the line start offsets as .npy"""
+    offsets = [0]
+    with open(path, "wb") as f:
+        for record in records:
+            line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(offsets_path, np.array(offsets, dtype=np.int64))
+
+
+class JsonLinesFile:
+    """Random access to one segment's JSON-lines records (e.g. chunk metadata)"""
+
+    def __init__(self, path: str, offsets_path: str):
+        self.path = path
+        try:
+            with NPY_LOAD_LOCK:
+                self.offsets = np.load(offsets_path, mmap_mode="r")
+        except FileNotFoundError:
+            # Segment written before offsets were saved: find the line starts once
+            data = np.fromfile(path, dtype=np.uint8)
+            self.offsets = np.concatenate([[0], np.flatnonzero(data == ord("\n")) + 1])
+        if os.path.getsize(path) != self.offsets[-1]:
+            raise ValueError(f"{path} does not match its line offsets")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Dict:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return json.loads(f.read(end - start).decode("utf-8"))
+
+    def iter_from(self, start: int):
+        with open(self.path, "rb") as f:
+            f.seek(int(self.offsets[start]))
+            for line in f:
+                yield json.loads(line.decode("utf-8"))
+
+
+class ChunkStore:
+    """
+    Sequence of chunk texts (or metadata dicts) spread over per-segment files.
+
+    Only the small offset indexes are resident; a lookup decompresses the
+    block holding the chunk and keeps it in a small LRU, so queries touch
+    just the blocks of their top-k hits. Metadata parts are JSON-lines files
+    read one line per lookup. Parts can also be plain lists (legacy
+    JSON-lines segments, or rows that could not be persisted).
+    """
+
+    def __init__(self, cache_blocks: int = 128):
+        self.parts: List[Union[ChunkBlockFile, JsonLinesFile, List]] = []
+        self.starts: List[int] = []
+        self.size = 0
+        self.cache_blocks = cache_blocks
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.size
+
+    def add_part(self, part: Union[ChunkBlockFile, JsonLinesFile, List]):
+        self.parts.append(part)
+        self.starts.append(self.size)
+        self.size += len(part)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate bytes held in RAM: in-memory parts, LRU blocks and offset indexes"""
+        total = 0
+        for part in self.parts:
+            if isinstance(part, list):
+                total += sum(len(item) if isinstance(item, str) else sys.getsizeof(item) for item in part)
+            else:
+                total += part.offsets.nbytes
+        with self._cache_lock:
+            total += sum(len(text) for texts in self._cache.values() for text in texts)
+        return total
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("chunk index out of range")
+        p = bisect.bisect_right(self.starts, i) - 1
+        part, local = self.parts[p], i - self.starts[p]
+        if not isinstance(part, ChunkBlockFile):
+            return part[local]
+        block = local // part.block_chunks
+        return self._block(p, part, block)[local - block * part.block_chunks]
+
+    def __iter__(self):
+        return self.iter_from(0)
+    
+    def iter_from(self, start: int):
+        """Texts from index `start` on, without decompressing earlier blocks"""
+        for part, part_start in zip(self.parts, self.starts):
+            if part_start + len(part) <= start:
+                continue
+            local = max(start - part_start, 0)
+            if isinstance(part, list):
+                yield from part[local:]
+            elif isinstance(part, JsonLinesFile):
+                yield from part.iter_from(local)
+            else:
+                # Sequential scan: read blocks directly, bypassing the LRU
+                first = local // part.block_chunks
+                for block in range(first, len(part.offsets) - 1):
+                    texts = part.read_block(block)
+                    yield from texts[local - first * part.block_chunks:] if block == first else texts
+
+    def _block(self, p: int, part: ChunkBlockFile, block: int) -> List[str]:
+        key = (p, block)
+        with self._cache_lock:
+            texts = self._cache.get(key)
+            if texts is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return texts
+        texts = part.read_block(block)
+        with self._cache_lock:
+            self.misses += 1
+            self._cache[key] = texts
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return texts
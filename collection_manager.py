@@ -0,0 +1,171 @@
+# src/collection_manager.py - NAMED, LAZILY LOADED VECTOR STORE COLLECTIONS
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from vector_store import SimpleVectorStore
+
+DEFAULT_COLLECTION = "document_qa"
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class CollectionManager:
+    """
+    Hosts many independent collections under one directory:
+
+        persist_dir/collections/<name>/    one SimpleVectorStore each
+
+    A collection is opened on first use and kept in an LRU. Whenever the
+    loaded collections together exceed `memory_budget_mb`, the least recently
+    used ones are closed; their data stays on disk and is reopened on the
+    next request.
+    """
+
+    def __init__(self, persist_dir: str = "./vector_db", memory_budget_mb: int = 1024,
+                 store_kwargs: Optional[Dict] = None, default_collection: str = DEFAULT_COLLECTION):
+        self.persist_dir = persist_dir
+        self.collections_dir = os.path.join(persist_dir, "collections")
+        os.makedirs(self.collections_dir, exist_ok=True)
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.store_kwargs = store_kwargs or {}
+        self.default_collection = default_collection
+
+        # _lock guards the LRU only; opening a store happens under a per-name
+        # lock so one slow load does not block the other collections
+        self._loaded: "OrderedDict[str, SimpleVectorStore]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._name_locks: Dict[str, threading.Lock] = {}
+        # Evicted stores still being closed; a name is reopened only after its
+        # old instance has finished (see _finish_eviction)
+        self._closing: Dict[str, Tuple[SimpleVectorStore, int]] = {}
+        self._migrate_single_store()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a manager using the store settings from Config"""
+        return cls(config.PERSIST_DIRECTORY, memory_budget_mb=config.COLLECTION_MEMORY_BUDGET_MB,
+                   store_kwargs=SimpleVectorStore.config_kwargs(config),
+                   default_collection=config.COLLECTION_NAME)
+
+    def _path(self, name: str) -> str:
+        if not COLLECTION_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid collection name '{name}': use letters, digits, '-' or '_'")
+        return os.path.join(self.collections_dir, name)
+
+    def _migrate_single_store(self):
+        """Move a pre-collections store at the top of persist_dir into the default collection"""
+        legacy = [name for name in os.listdir(self.persist_dir)
+                  if name in ("manifest.json", "segments", "versions", "wal.jsonl", "vector_store.pkl")
+                  or name.startswith("tombstones_")]
+        target = os.path.join(self.collections_dir, self.default_collection)
+        if not legacy or os.path.exists(target):
+            return
+        os.makedirs(target)
+        for name in legacy:
+            os.replace(os.path.join(self.persist_dir, name), os.path.join(target, name))
+        print(f"✓ Moved existing store into collection '{self.default_collection}'")
+
+    def list_collections(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.collections_dir)
+                      if os.path.isdir(os.path.join(self.collections_dir, name)))
+
+    def loaded_collections(self) -> List[str]:
+        """Names of the collections currently in memory, least recently used first"""
+        with self._lock:
+            return list(self._loaded)
+
+    def _name_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.Lock())
+
+    def get(self, name: Optional[str] = None) -> SimpleVectorStore:
+        """Return a collection, opening (and creating) it on first use.
+
+        The budget is checked on every call, so collections that grew through
+        add_documents since the last call can push colder ones out.
+        """
+        name = name or self.default_collection
+        path = self._path(name)
+        with self._lock:
+            store = self._loaded.get(name)
+            if store is not None:
+                self._loaded.move_to_end(name)
+
+        if store is None:
+            with self._name_lock(name):
+                with self._lock:
+                    store = self._loaded.get(name)
+                if store is None:
+                    # Never two writable instances: an evicted one closes first
+                    self._finish_eviction(name)
+                    store = SimpleVectorStore(path, **self.store_kwargs)
+                    with self._lock:
+                        self._loaded[name] = store
+
+        self.enforce_budget(keep=name)
+        return store
+
+    def create_collection(self, name: str) -> SimpleVectorStore:
+        return self.get(name)
+
+    def drop_collection(self, name: str):
+        """Delete a collection and its files"""
+        path = self._path(name)
+        with self._name_lock(name):
+            with self._lock:
+                store = self._loaded.pop(name, None)
+            if store is not None:
+                store.close()
+            self._finish_eviction(name)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate bytes per loaded collection"""
+        with self._lock:
+            return {name: sum(store.memory_usage().values()) for name, store in self._loaded.items()}
+
+    def enforce_budget(self, keep: Optional[str] = None):
+        """Evict least recently used collections until the budget is met"""
+        evicted = []
+        with self._lock:
+            usage = self.memory_usage()
+            total = sum(usage.values())
+            for name in list(self._loaded):
+                if total <= self.memory_budget:
+                    break
+                if name == keep:
+                    continue
+                self._closing[name] = (self._loaded.pop(name), usage[name])
+                evicted.append(name)
+                total -= usage[name]
+
+        # Closing waits for the store's writers, so it happens outside _lock
+        for name in evicted:
+            with self._name_lock(name):
+                self._finish_eviction(name)
+
+    def _finish_eviction(self, name: str):
+        """Close the evicted instance of a collection, if any; the caller holds its name lock.
+
+        close() waits for the store's writers, including a background
+        compaction, so files the old instance is still writing cannot clash
+        with a new instance's segments.
+        """
+        with self._lock:
+            store, size = self._closing.pop(name, (None, 0))
+        if store is not None:
+            store.close()
+            print(f"✓ Evicted collection '{name}' ({size / 1e6:.1f} MB)")
+
+    def close(self):
+        """Close every loaded collection"""
+        with self._lock:
+            stores = list(self._loaded.values()) + [store for store, _ in self._closing.values()]
+            self._loaded.clear()
+            self._closing.clear()
+        for store in stores:
+            store.close()
@@ -14,8 +14,36 @@ class Config:
     MAX_CONTEXT_LENGTH: int = 4000
     DIVERSITY_THRESHOLD: float = 0.9
     
+    # Cross-encoder rerank of the first-stage hits
+    RERANK: bool = False
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    RERANK_CANDIDATES: int = 20  # hits fetched for reranking; the top 5 are kept
+    RERANK_TIME_BUDGET_MS: float = 300.0  # unscored hits keep first-stage order
+    
     # Vector DB
     PERSIST_DIRECTORY: str = "./vector_db"
+    INDEX_TYPE: str = "flat"  # flat (exact), hnsw or ivf
+    HNSW_M: int = 32
+    HNSW_EF_SEARCH: int = 64
+    IVF_NLIST: int = 256
+    IVF_NPROBE: int = 16
+    QUANTIZATION: str = "none"  # none, int8 or pq (flat index only): saves memory, not scan time
+    RERANK_FACTOR: int = 4
+    PQ_M: int = 48
+    COMPACTION_THRESHOLD: float = 0.2  # compact once this fraction of rows is deleted
+    SEARCH_SHARDS: int = 1  # >1 splits exact search across worker processes
+    EMBEDDING_DTYPE: str = "float32"  # float16 halves vector memory and disk I/O
+    COLLECTION_NAME: str = "document_qa"
+    COLLECTION_MEMORY_BUDGET_MB: int = 1024  # evict cold collections beyond this
+    
+    # Embedding encoding
+    EMBEDDING_BACKEND: str = "hashing"  # hashing (no model), torch (sentence-transformers) or onnx (onnxruntime, no torch)
+    ONNX_QUANTIZE: bool = False  # dynamic int8 weights for the ONNX backend
+    ENCODE_WORKERS: int = 1  # >1 encodes sentence-transformers batches in worker processes
+    
+    # Embedding cache
+    EMBEDDING_CACHE_DIR: str = "./embedding_cache"
+    EMBEDDING_CACHE_MAX_MB: int = 512
     
     # LLM settings
     USE_OPENAI: bool = False
@@ -28,7 +56,17 @@ class Config:
         dotenv.load_dotenv()
         
         return cls(
-            USE_OPENAI=os.getenv("USE_OPENAI", "false").lower() == "true"
+            USE_OPENAI=os.getenv("USE_OPENAI", "false").lower() == "true",
+            INDEX_TYPE=os.getenv("INDEX_TYPE", "flat").lower(),
+            QUANTIZATION=os.getenv("QUANTIZATION", "none").lower(),
+            SEARCH_SHARDS=int(os.getenv("SEARCH_SHARDS", "1")),
+            COLLECTION_NAME=os.getenv("COLLECTION_NAME", "document_qa"),
+            ENCODE_WORKERS=int(os.getenv("ENCODE_WORKERS", "1")),
+            EMBEDDING_DTYPE=os.getenv("EMBEDDING_DTYPE", "float32").lower(),
+            EMBEDDING_BACKEND=os.getenv("EMBEDDING_BACKEND", "hashing").lower(),
+            ONNX_QUANTIZE=os.getenv("ONNX_QUANTIZE", "false").lower() == "true",
+            RERANK=os.getenv("RERANK", "false").lower() == "true",
+            RERANK_TIME_BUDGET_MS=float(os.getenv("RERANK_TIME_BUDGET_MS", "300"))
         )
 
 # Global config instance
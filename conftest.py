@@ -0,0 +1,7 @@
+# conftest.py - PYTEST SETUP
+import os
+import sys
+
+# Tests import modules by bare name, as the modules import each other, so
+# each module is loaded once whichever directory pytest is started from
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
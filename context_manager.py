@@ -1,8 +1,10 @@
 from typing import List, Dict, Tuple
 
+from token_counter import chunk_tokens
+
 class ContextManager:
-    def __init__(self, max_context_length: int = 4000):
-        self.max_context_length = max_context_length
+    def __init__(self, max_context_tokens: int = 4000):
+        self.max_context_tokens = max_context_tokens
     
     def filter_context(self, documents: List[str], 
                       metadatas: List[Dict], 
@@ -13,26 +15,28 @@ class ContextManager:
         """
         filtered_docs = []
         filtered_metas = []
-        total_length = 0
+        total_tokens = 0
         
-        # Combine similar chunks from same source
+        # Combine similar chunks from same source, keeping the best-ranked one
         source_map = {}
         for doc, meta, score in zip(documents, metadatas, scores):
             source_key = f"{meta.get('source', 'unknown')}_{meta.get('page', 0)}"
-            if source_key not in source_map or score > source_map[source_key]['score']:
+            if source_key not in source_map:
                 source_map[source_key] = {'doc': doc, 'meta': meta, 'score': score}
         
-        # Sort by score and select within length limit
-        sorted_items = sorted(source_map.values(), key=lambda x: x['score'], reverse=True)
+        # Keep the incoming rank order (MMR / rerank order is not score order)
+        sorted_items = list(source_map.values())
         
         for item in sorted_items:
             doc = item['doc']
             meta = item['meta']
             
-            if total_length + len(doc) <= self.max_context_length:
+            # Token count stored at ingestion
+            doc_tokens = chunk_tokens(doc, meta)
+            if total_tokens + doc_tokens <= self.max_context_tokens:
                 filtered_docs.append(doc)
                 filtered_metas.append(meta)
-                total_length += len(doc)
+                total_tokens += doc_tokens
         
         # Format context
         formatted_context = ""
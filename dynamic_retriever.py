@@ -1,10 +1,20 @@
 import numpy as np
 from typing import List, Tuple, Dict
 
+from token_counter import chunk_tokens
+
 class DynamicRetriever:
     def __init__(self, vector_store, similarity_threshold: float = 0.75, 
-                 max_tokens: int = 4000, diversity_threshold: float = 0.9):
+                 max_tokens: int = 4000, diversity_threshold: float = 0.9,
+                 hybrid: bool = False, mmr_lambda: float = 0.7,
+                 initial_k: int = 8, max_k: int = 512):
         self.vector_store = vector_store
+        # Candidate pool: starts at initial_k and doubles up to max_k as needed
+        self.initial_k = initial_k
+        self.max_k = max_k
+        self.hybrid = hybrid
+        # MMR trade-off: 1.0 keeps pure relevance order, lower values favour diversity
+        self.mmr_lambda = mmr_lambda
         self.similarity_threshold = similarity_threshold
         self.max_tokens = max_tokens
         self.diversity_threshold = diversity_threshold
@@ -12,57 +22,76 @@ class DynamicRetriever:
     def retrieve_dynamic(self, query_embedding: np.ndarray, 
                         query_text: str) -> Tuple[List[str], List[Dict], List[float]]:
         """
-        Dynamic retrieval with adaptive stopping conditions
+        Dynamic retrieval with adaptive stopping conditions.
+        
+        Progressive deepening: search with a small k and double it only
+        while every hit still clears similarity_threshold and the selection
+        has not filled the token budget, so the candidates scored track the
+        real answer set instead of a fixed top-20.
         """
-        all_documents = []
-        all_metadatas = []
-        all_scores = []
+        k, previous_k = self.initial_k, 0
+        while True:
+            documents, metadatas, scores, embeddings = self._fetch(query_embedding, query_text, k)
+            scores = np.asarray(scores, dtype=np.float32)
+            selected, budget_full = self._select(documents, metadatas, scores, embeddings)
+            
+            # All hits fetched, or the new ranks fail the threshold: dense hits
+            # are sorted, so one failing hit ends the search; fused hybrid
+            # ranks are not, so it ends once none of the new ranks passes
+            below = scores[previous_k:] < self.similarity_threshold
+            exhausted = len(documents) < k or (below.all() if self.hybrid else below.any())
+            if budget_full or exhausted or k >= self.max_k:
+                break
+            k, previous_k = min(2 * k, self.max_k), k
         
+        return ([documents[i] for i in selected], [metadatas[i] for i in selected],
+                [float(scores[i]) for i in selected])
+    
+    def _fetch(self, query_embedding: np.ndarray, query_text: str, k: int):
+        """Top-k candidates with the stored embeddings of the hits"""
+        if self.hybrid:
+            return self.vector_store.hybrid_search(query_text, query_embedding, k=k,
+                                                   fetch_k=max(50, k), return_embeddings=True)
+        return self.vector_store.similarity_search(query_embedding, k=k, return_embeddings=True)
+    
+    def _select(self, documents: List[str], metadatas: List[Dict], scores: np.ndarray,
+                embeddings: np.ndarray) -> Tuple[List[int], bool]:
+        """Candidates in MMR order up to the token budget; True if the budget was reached"""
+        selected = []
         total_tokens = 0
-        max_initial_results = 20
-        
-        # Get initial batch
-        documents, metadatas, scores = self.vector_store.similarity_search(
-            query_embedding, k=max_initial_results
-        )
-        
-        for doc, meta, score in zip(documents, metadatas, scores):
-            # Stop condition 1: Similarity below threshold
-            if score < self.similarity_threshold:
-                break
-            
+        for i in self._mmr_order(scores, embeddings):
             # Stop condition 2: Token budget exceeded
-            doc_tokens = len(doc) // 4  # Rough estimate
+            doc_tokens = chunk_tokens(documents[i], metadatas[i])  # counted at ingestion
             if total_tokens + doc_tokens > self.max_tokens:
-                break
-            
-            # Stop condition 3: Redundant content
-            if self._is_redundant(doc, all_documents):
-                continue
-            
-            # Add to results
-            all_documents.append(doc)
-            all_metadatas.append(meta)
-            all_scores.append(score)
+                return selected, True
+            selected.append(i)
             total_tokens += doc_tokens
-        
-        return all_documents, all_metadatas, all_scores
+        return selected, False
     
-    def _is_redundant(self, new_doc: str, existing_docs: List[str]) -> bool:
-        """Check if document adds new information"""
-        if not existing_docs:
-            return False
-        
-        for existing_doc in existing_docs:
-            # Calculate simple word overlap
-            new_words = set(new_doc.lower().split())
-            existing_words = set(existing_doc.lower().split())
-            
-            if not new_words or not existing_words:
-                continue
-            
-            overlap = len(new_words.intersection(existing_words)) / len(new_words.union(existing_words))
-            if overlap > self.diversity_threshold:
-                return True
+    def _mmr_order(self, scores: np.ndarray, embeddings: np.ndarray) -> List[int]:
+        """
+        Maximal marginal relevance over the candidates, from one Gram matrix.
         
-        return False
\ No newline at end of file
+        Candidates below similarity_threshold are dropped (stop condition 1;
+        hybrid hits carry their cosine too, so keyword-only matches that are
+        semantically unrelated are dropped as well), and any candidate whose
+        cosine to an already selected one exceeds diversity_threshold is
+        redundant (stop condition 3).
+        """
+        keep = np.flatnonzero(scores >= self.similarity_threshold)
+        if len(keep) == 0:
+            return []
+        gram = embeddings[keep] @ embeddings[keep].T
+        relevance = scores[keep]
+        max_sim = np.full(len(keep), -np.inf, dtype=np.float32)  # to the selected set
+        available = np.ones(len(keep), dtype=bool)
+        order = []
+        while available.any():
+            penalty = np.where(np.isfinite(max_sim), max_sim, 0.0)
+            mmr = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * penalty
+            best = int(np.argmax(np.where(available, mmr, -np.inf)))
+            order.append(int(keep[best]))
+            max_sim = np.maximum(max_sim, gram[best])
+            available &= max_sim <= self.diversity_threshold
+            available[best] = False
+        return order
\ No newline at end of file
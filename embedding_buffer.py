@@ -0,0 +1,63 @@
+# src/embedding_buffer.py - GROWABLE FLOAT32 ROW BUFFER
+import numpy as np
+
+MIN_CAPACITY = 256
+
+
+class EmbeddingBuffer:
+    """
+    Preallocated float32 (or float16) matrix that grows by doubling its capacity.
+
+    Appending n rows is amortized O(n) instead of the O(total) copy that
+    np.vstack makes on every call. `view` exposes only the filled rows and
+    shares memory with the buffer, so it can be searched and persisted
+    without copying.
+    """
+
+    def __init__(self, dimension: int, capacity: int = 0, dtype=np.float32):
+        self.dimension = dimension
+        self.size = 0
+        self._data = np.empty((capacity, dimension), dtype=dtype)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    @property
+    def view(self) -> np.ndarray:
+        """Filled rows (a view, valid until the next reallocation)"""
+        return self._data[:self.size]
+
+    def reserve(self, capacity: int):
+        """Make room for at least `capacity` rows in total"""
+        if capacity <= self.capacity:
+            return
+        data = np.empty((capacity, self.dimension), dtype=self._data.dtype)
+        data[:self.size] = self._data[:self.size]
+        self._data = data
+
+    def append(self, rows: np.ndarray) -> np.ndarray:
+        """Copy rows in (casting to the buffer dtype) and return the view of the new rows"""
+        staged = self.stage(rows)
+        self.commit(len(staged))
+        return staged
+
+    def stage(self, rows: np.ndarray) -> np.ndarray:
+        """Copy rows into the spare capacity without making them part of `view`"""
+        rows = np.asarray(rows).reshape(-1, self.dimension)
+        needed = self.size + len(rows)
+        if needed > self.capacity:
+            self.reserve(max(needed, 2 * self.capacity, MIN_CAPACITY))
+        self._data[self.size:needed] = rows
+        return self._data[self.size:needed]
+
+    def commit(self, n_rows: int):
+        """Expose the next n_rows staged rows through `view`"""
+        self.size += n_rows
@@ -0,0 +1,105 @@
+# src/embedding_cache.py - CONTENT-ADDRESSED ON-DISK EMBEDDING CACHE
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+
+# Keys per SELECT ... IN (...), below SQLite's bound-parameter limit
+LOOKUP_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by sha1(model id, text) in a small SQLite file.
+
+    The model id names the model and its version, so switching models never
+    returns stale vectors. Lookups and inserts are batched, the least
+    recently used entries are evicted once the cache grows past `max_mb`,
+    and hit/miss counters report how much encoding was saved.
+    """
+
+    def __init__(self, cache_dir: str = "./embedding_cache", max_mb: float = 512):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "embeddings.sqlite")
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def key(model_id: str, text: str) -> str:
+        return hashlib.sha1(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate,
+                "entries": entries, "bytes": size}
+
+    def get_many(self, model_id: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vector per text, or None where it has not been embedded yet"""
+        keys = [self.key(model_id, text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start + LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+
+        vectors = [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+        hits = sum(vector is not None for vector in vectors)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, model_id: str, texts: List[str], embeddings: np.ndarray):
+        """Store one vector per text, then evict down to the size bound"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(self.key(model_id, text), vector.tobytes(), now)
+                 for text, vector in zip(texts, embeddings)])
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        size, = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        if size <= self.max_bytes:
+            return
+        # Drop least recently used rows until ~10% under the bound, so
+        # eviction does not run again on every insert
+        excess = size - int(0.9 * self.max_bytes)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM ("
+            " SELECT key, SUM(LENGTH(vector)) OVER (ORDER BY last_used, key) - LENGTH(vector) AS before"
+            " FROM embeddings) WHERE before < ?)",
+            (excess,))
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
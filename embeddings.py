@@ -1,52 +1,149 @@
 # src/embeddings.py - FIXED FOR WINDOWS
 import numpy as np
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterable, Iterator
 import os
+import zlib
+import threading
 import warnings
+from collections import OrderedDict
 
 class EmbeddingGenerator:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2", use_torch: bool = False):
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", use_torch: bool = False,
+                 cache=None, n_workers: int = 1, query_cache_size: int = 1024,
+                 backend: str = "torch", onnx_quantize: bool = False):
         """
-        Initialize with fallback options for Windows
+        Initialize with fallback options for Windows.
+        `cache` is an optional EmbeddingCache consulted before encoding;
+        `n_workers` > 1 encodes sentence-transformers batches in a process pool;
+        the last `query_cache_size` query embeddings are kept in memory;
+        `backend="onnx"` runs the model through onnxruntime (optionally int8).
         """
         self.model_name = model_name
         self.model = None
         self.dimension = 384
         self.use_torch = use_torch
+        self.cache = cache
+        self.pool = None
         
+        # LRU of query embeddings keyed by (model id, whitespace-normalized text)
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.query_hits = 0
+        self.query_misses = 0
+        
+        if backend == "onnx":
+            try:
+                from onnx_encoder import OnnxEncoder
+                self.model = OnnxEncoder(model_name, quantize=onnx_quantize)
+                self.dimension = self.model.get_sentence_embedding_dimension()
+                print(f"✓ Loaded ONNX model: {self.model.model_id}")
+            except Exception as e:
+                print(f"⚠️ Could not load ONNX model: {e}")
+                print("   Falling back to hashed term features...")
+                self._init_hashing()
         # Try to load sentence-transformers
-        if use_torch:
+        elif use_torch:
             try:
                 from sentence_transformers import SentenceTransformer
                 self.model = SentenceTransformer(model_name)
                 self.dimension = self.model.get_sentence_embedding_dimension()
                 print(f"✓ Loaded sentence-transformers: {model_name}")
+                if n_workers > 1:
+                    from encode_pool import EncodePool
+                    self.pool = EncodePool(model_name, n_workers)
             except Exception as e:
                 print(f"⚠️ Could not load sentence-transformers: {e}")
-                print("   Falling back to TF-IDF...")
-                self._init_tfidf()
+                print("   Falling back to hashed term features...")
+                self._init_hashing()
         else:
-            # Use TF-IDF (no torch dependency)
-            self._init_tfidf()
+            # Use hashed term features (no torch dependency)
+            self._init_hashing()
     
-    def _init_tfidf(self):
-        """Initialize TF-IDF vectorizer"""
+    def _init_hashing(self):
+        """
+        Initialize a stateless hashing vectorizer.
+        
+        Terms are hashed straight into `dimension` buckets, so nothing is fit
+        on the data: every batch and every query lands in the same vector
+        space, and vectors already in the store stay valid after new uploads.
+        """
         try:
-            from sklearn.feature_extraction.text import TfidfVectorizer
-            self.model = TfidfVectorizer(max_features=384, stop_words='english')
-            print("✓ Using TF-IDF embeddings (CPU-friendly)")
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self.model = HashingVectorizer(n_features=self.dimension, ngram_range=(1, 2),
+                                           stop_words='english', alternate_sign=True, norm='l2',
+                                           dtype=np.float32)
+            print("✓ Using hashed term embeddings (CPU-friendly)")
         except ImportError:
             print("⚠️ scikit-learn not available, using random embeddings")
             self.model = None
     
+    @property
+    def model_id(self) -> str:
+        """Identifies the vector space: model, version and settings"""
+        if hasattr(self.model, 'model_id'):
+            return self.model.model_id
+        if hasattr(self.model, 'encode'):
+            import sentence_transformers
+            return f"st:{self.model_name}:{sentence_transformers.__version__}"
+        if hasattr(self.model, 'transform'):
+            import sklearn
+            return f"hashing:{self.dimension}:{self.model.ngram_range}:{sklearn.__version__}"
+        return f"random:{self.dimension}"
+    
     def generate_embeddings(self, chunks: List[Tuple[str, Dict]]) -> Tuple[np.ndarray, List[Dict]]:
-        """Generate embeddings for text chunks"""
+        """Generate embeddings for text chunks (cached chunks are not re-encoded)"""
         texts = [chunk[0] for chunk in chunks]
         metadatas = [chunk[1] for chunk in chunks]
         
+        if self.cache is None:
+            return self._encode(texts), metadatas
+        
+        model_id = self.model_id
+        cached = self.cache.get_many(model_id, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        print(f"✓ Embedding cache: {len(texts) - len(missing)}/{len(texts)} chunks already embedded")
+        
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                embeddings[i] = vector
+        if missing:
+            # Encode each distinct missing text once
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = self._encode(unique)
+            self.cache.put_many(model_id, unique, encoded)
+            rows = {text: row for text, row in zip(unique, encoded)}
+            for i in missing:
+                embeddings[i] = rows[texts[i]]
+        return embeddings, metadatas
+    
+    def iter_embeddings(self, chunks: Iterable[Tuple[str, Dict]],
+                        batch_size: int = 512) -> Iterator[Tuple[np.ndarray, List[Dict], List[str]]]:
+        """
+        Yield (embeddings, metadatas, texts) for successive batches of chunks.
+        
+        Each block is contiguous float32, ready for SimpleVectorStore.add_documents,
+        so peak memory follows the batch size instead of the corpus size.
+        """
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                embeddings, metadatas = self.generate_embeddings(batch)
+                yield embeddings, metadatas, [text for text, _ in batch]
+                batch = []
+        if batch:
+            embeddings, metadatas = self.generate_embeddings(batch)
+            yield embeddings, metadatas, [text for text, _ in batch]
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
         print(f"Generating embeddings for {len(texts)} chunks...")
         
-        if hasattr(self.model, 'encode'):
+        if self.pool is not None and len(texts) > self.pool.batch_size:
+            # SentenceTransformers across worker processes
+            embeddings = self.pool.encode(texts)
+        elif hasattr(self.model, 'encode'):
             # SentenceTransformers
             embeddings = self.model.encode(
                 texts,
@@ -54,39 +151,69 @@ class EmbeddingGenerator:
                 convert_to_numpy=True,
                 normalize_embeddings=True
             )
-        elif hasattr(self.model, 'fit_transform'):
-            # TF-IDF
-            embeddings = self.model.fit_transform(texts).toarray()
-            # Normalize
-            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
-            norms[norms == 0] = 1  # Avoid division by zero
-            embeddings = embeddings / norms
+        elif hasattr(self.model, 'transform'):
+            # Hashed terms, built as float32 so the dense block is not copied
+            # again below (already L2-normalized; empty texts stay all-zero)
+            embeddings = self.model.transform(texts).toarray()
         else:
             # Random embeddings (for demo)
-            np.random.seed(42)
-            embeddings = np.random.randn(len(texts), self.dimension)
-            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = np.array([self._random_embedding(text) for text in texts]).reshape(-1, self.dimension)
         
         # Ensure correct dtype for FAISS
         embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
         print(f"✓ Generated embeddings: {embeddings.shape}")
         
-        return embeddings, metadatas
+        return embeddings
     
     def embed_query(self, text: str) -> np.ndarray:
-        """Generate embedding for a single query"""
+        """Generate embedding for a single query (repeated queries hit an LRU)"""
+        # The model id is part of the key, so swapping models never serves stale vectors
+        key = (self.model_id, " ".join(text.split()))
+        with self._query_cache_lock:
+            embedding = self._query_cache.get(key)
+            if embedding is not None:
+                self._query_cache.move_to_end(key)
+                self.query_hits += 1
+                return embedding.copy()
+        
+        embedding = self._embed_query(text)
+        with self._query_cache_lock:
+            self.query_misses += 1
+            if self.query_cache_size > 0:
+                self._query_cache[key] = embedding
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+        return embedding.copy()
+    
+    def _embed_query(self, text: str) -> np.ndarray:
         if hasattr(self.model, 'encode'):
             embedding = self.model.encode([text], convert_to_numpy=True)[0]
         elif hasattr(self.model, 'transform'):
             embedding = self.model.transform([text]).toarray()[0]
-            # Normalize
-            norm = np.linalg.norm(embedding)
-            if norm > 0:
-                embedding = embedding / norm
         else:
-            # Random embedding
-            np.random.seed(hash(text) % 10000)
-            embedding = np.random.randn(self.dimension)
-            embedding = embedding / np.linalg.norm(embedding)
+            embedding = self._random_embedding(text)
         
-        return np.ascontiguousarray(embedding, dtype=np.float32)
\ No newline at end of file
+        return np.ascontiguousarray(embedding, dtype=np.float32)
+    
+    def _random_embedding(self, text: str) -> np.ndarray:
+        """Deterministic per-text random unit vector (stable across processes, unlike hash())"""
+        rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+        embedding = rng.standard_normal(self.dimension)
+        return embedding / np.linalg.norm(embedding)
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate bytes for the model weights and the query LRU"""
+        model = 0
+        if hasattr(self.model, 'parameters'):
+            model = sum(p.numel() * p.element_size() for p in self.model.parameters())
+        elif hasattr(self.model, 'nbytes'):
+            model = self.model.nbytes
+        with self._query_cache_lock:
+            queries = sum(e.nbytes for e in self._query_cache.values())
+        return {"model": int(model), "query_cache": int(queries)}
+    
+    def close(self):
+        """Stop the encode worker processes, if any"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
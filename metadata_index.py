@@ -0,0 +1,136 @@
+# src/metadata_index.py - COLUMNAR METADATA FOR FILTERED SEARCH
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+MIN_CAPACITY = 256
+MISSING = -1
+
+
+class MetadataIndex:
+    """
+    Columnar copy of the filterable chunk metadata, one int32 row per chunk.
+
+    Strings (source file, doc hash) are dictionary-encoded to integer ids, so
+    a filter becomes a vectorized comparison over a NumPy column instead of a
+    Python loop over metadata dicts.
+
+    Filter syntax (all conditions are ANDed):
+        {"source": "report.pdf"}             equality
+        {"source": ["a.pdf", "b.pdf"]}       membership (list or set)
+        {"page": (3, 10)}                    inclusive range (2-tuple)
+        {"doc_hash": "1a2b3c4d", "chunk_id": [0, 1, 2]}
+        {"tokens": (0, 500)}                 chunk length in tokens
+    """
+
+    FIELDS = ("source", "page", "doc_hash", "chunk_id", "tokens")
+    ENCODED_FIELDS = ("source", "doc_hash")
+
+    def __init__(self):
+        self.size = 0
+        self._data = np.empty((0, len(self.FIELDS)), dtype=np.int32)
+        self.codes = {field: {} for field in self.ENCODED_FIELDS}
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    def column(self, field: str) -> np.ndarray:
+        return self._data[:self.size, self.FIELDS.index(field)]
+
+    def values(self, field: str, mask: Optional[np.ndarray] = None) -> List:
+        """Distinct values of a field, optionally over the rows in a mask"""
+        column = self.column(field) if mask is None else self.column(field)[mask]
+        present = [int(v) for v in np.unique(column) if v != MISSING]
+        if field not in self.ENCODED_FIELDS:
+            return present
+        names = list(self.codes[field])
+        return [names[code] for code in present]
+
+    def _grow(self, needed: int):
+        if needed > len(self._data):
+            data = np.empty((max(needed, 2 * len(self._data), MIN_CAPACITY), len(self.FIELDS)),
+                            dtype=np.int32)
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+
+    def add(self, metadatas: List[Dict], tokens: Optional[np.ndarray] = None):
+        """Append one row per metadata dict (tokens, if given, fills the tokens column)"""
+        needed = self.size + len(metadatas)
+        self._grow(needed)
+
+        rows = self._data[self.size:needed]
+        for row, meta in zip(rows, metadatas):
+            for col, field in enumerate(self.FIELDS):
+                row[col] = self._encode(field, meta.get(field), add=True)
+        if tokens is not None:
+            rows[:, self.FIELDS.index("tokens")] = tokens
+        self.size = needed
+
+    @classmethod
+    def encode(cls, metadatas: List[Dict], tokens: Optional[np.ndarray] = None) -> Tuple[np.ndarray, Dict]:
+        """Columns of a batch of rows with its own string code tables (saved per segment)"""
+        index = cls()
+        index.add(metadatas, tokens)
+        info = {"fields": list(cls.FIELDS),
+                "codes": {field: list(index.codes[field]) for field in cls.ENCODED_FIELDS}}
+        return index._data[:index.size].copy(), info
+
+    def add_encoded(self, rows: np.ndarray, info: Dict):
+        """Append rows from encode(), remapping their string codes to this index's codes"""
+        needed = self.size + len(rows)
+        self._grow(needed)
+        out = self._data[self.size:needed]
+        out[:] = MISSING
+        for col, field in enumerate(info["fields"]):
+            if field not in self.FIELDS:
+                continue
+            values = np.asarray(rows[:, col])
+            if field in self.ENCODED_FIELDS:
+                # Trailing MISSING entry: local code -1 maps to MISSING
+                lookup = [self._encode(field, value, add=True) for value in info["codes"][field]]
+                values = np.array(lookup + [MISSING], dtype=np.int32)[values]
+            out[:, self.FIELDS.index(field)] = values
+        self.size = needed
+
+    def _encode(self, field: str, value, add: bool = False) -> int:
+        if value is None:
+            return MISSING
+        if field in self.ENCODED_FIELDS:
+            codes = self.codes[field]
+            if value not in codes:
+                if not add:
+                    return MISSING
+                codes[value] = len(codes)
+            return codes[value]
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return MISSING
+
+    def mask(self, filter: Optional[Dict]) -> Optional[np.ndarray]:
+        """Boolean row mask for a filter dict (None means no filtering)"""
+        if not filter:
+            return None
+
+        mask = np.ones(self.size, dtype=bool)
+        for field, condition in filter.items():
+            if field not in self.FIELDS:
+                raise ValueError(f"Cannot filter on '{field}', expected one of {self.FIELDS}")
+            column = self.column(field)
+
+            if isinstance(condition, tuple):
+                low, high = condition
+                mask &= (column >= int(low)) & (column <= int(high))
+            elif isinstance(condition, (list, set, frozenset)):
+                values = [self._encode(field, v) for v in condition]
+                mask &= np.isin(column, [v for v in values if v != MISSING])
+            else:
+                value = self._encode(field, condition)
+                if value == MISSING:
+                    mask[:] = False
+                else:
+                    mask &= column == value
+        return mask
@@ -0,0 +1,116 @@
+# src/onnx_encoder.py - ONNX RUNTIME BACKEND FOR SENTENCE-TRANSFORMERS MODELS
+import os
+import numpy as np
+from typing import List
+
+# MiniLM's sentence-transformers max_seq_length
+MAX_SEQ_LENGTH = 256
+
+
+def export_onnx(model_name: str, out_dir: str) -> str:
+    """
+    One-time export of a sentence-transformers model to ONNX (needs torch).
+
+    Writes model.onnx (token embeddings) and tokenizer.json to out_dir; mean
+    pooling and normalization are done in NumPy by OnnxEncoder.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(out_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model[0].tokenizer
+    tokenizer.save_pretrained(out_dir)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic = {"batch": 0, "sequence": 1}
+    path = os.path.join(out_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(transformer, tuple(sample[name] for name in names), path,
+                          input_names=names, output_names=["last_hidden_state"],
+                          dynamic_axes={name: dynamic for name in names + ["last_hidden_state"]},
+                          opset_version=14)
+    print(f"✓ Exported {model_name} to {path}")
+    return path
+
+
+def quantize_onnx(path: str) -> str:
+    """Dynamic int8 quantization of the weights (activations stay float)"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantized_path = path.replace(".onnx", ".int8.onnx")
+    quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+    print(f"✓ Quantized model to {quantized_path}")
+    return quantized_path
+
+
+class OnnxEncoder:
+    """
+    CPU inference for MiniLM-style models through onnxruntime.
+
+    Exposes the subset of the SentenceTransformer interface that
+    EmbeddingGenerator uses (`encode`, `get_sentence_embedding_dimension`),
+    so it can stand in for the torch model. At runtime only onnxruntime and
+    tokenizers are imported, which keeps cold start short; torch is only
+    needed once, to export the model.
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", model_dir: str = "./onnx_models",
+                 quantize: bool = False, threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        out_dir = os.path.join(model_dir, model_name.replace("/", "_"))
+        path = os.path.join(out_dir, "model.onnx")
+        if not os.path.exists(path):
+            export_onnx(model_name, out_dir)
+        if quantize:
+            quantized_path = path.replace(".onnx", ".int8.onnx")
+            path = quantized_path if os.path.exists(quantized_path) else quantize_onnx(path)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(out_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads  # 0 lets onnxruntime pick
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+        self.model_id = f"onnx{'-int8' if quantize else ''}:{model_name}:{ort.__version__}"
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the loaded model file, a proxy for the session's weights"""
+        return os.path.getsize(self.path)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False) -> np.ndarray:
+        """Mean-pooled sentence embeddings, like SentenceTransformer.encode"""
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            inputs = {name: value for name, value in inputs.items() if name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            embeddings[start:start + len(encodings)] = pooled
+
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+        return embeddings
@@ -0,0 +1,190 @@
+# src/quantization.py - COMPRESSED EMBEDDINGS FOR THE FIRST-PASS SCAN
+import hashlib
+import numpy as np
+from typing import Dict, List, Tuple
+
+from vector_index import top_k, merge_top_k
+
+QUANTIZATION_TYPES = ("none", "int8", "pq")
+
+# Rows upcast/decoded at a time while scanning codes, bounds temporary memory
+SCAN_ROWS = 32768
+# Rows used to train the quantizer (sampled evenly over the store)
+TRAIN_ROWS = 20000
+
+
+class ScalarQuantizer:
+    """Symmetric per-dimension int8 quantization (4x smaller than float32)"""
+
+    def __init__(self):
+        self.scale = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.scale is not None
+
+    @property
+    def code_size(self) -> int:
+        return len(self.scale)
+
+    def train(self, vectors: np.ndarray):
+        max_abs = np.abs(vectors).max(axis=0)
+        max_abs[max_abs == 0] = 1
+        self.scale = (max_abs / 127.0).astype(np.float32)
+        print(f"✓ Trained int8 quantizer on {len(vectors)} vectors")
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {"scale": self.scale}
+
+    def set_state(self, state: Dict[str, np.ndarray], dimension: int) -> bool:
+        """Adopt a saved state; False if it does not fit this dimension"""
+        if state["scale"].shape != (dimension,):
+            return False
+        self.scale = state["scale"].astype(np.float32)
+        return True
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate inner products, shape (n_queries, n_codes)"""
+        scaled = queries * self.scale
+        return np.hstack([scaled @ codes[i:i + SCAN_ROWS].T.astype(np.float32)
+                          for i in range(0, len(codes), SCAN_ROWS)])
+
+
+class ProductQuantizer:
+    """
+    Product quantization: the vector is split into `m` sub-vectors and each
+    one is stored as the id of its nearest of 256 centroids (1 byte). With
+    m=48 a 384-dim float32 vector shrinks from 1536 to 48 bytes. Queries are
+    scored with per-query lookup tables (asymmetric distance computation).
+    """
+
+    def __init__(self, m: int = 48):
+        self.m = m
+        self.centroids = None  # (m, n_centroids, sub_dim)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def code_size(self) -> int:
+        return self.m
+
+    def train(self, vectors: np.ndarray):
+        from sklearn.cluster import KMeans
+
+        dimension = vectors.shape[1]
+        if dimension % self.m != 0:
+            raise ValueError(f"PQ needs the dimension ({dimension}) to be divisible by m ({self.m})")
+        n_centroids = min(256, len(vectors))
+        sub_dim = dimension // self.m
+
+        centroids = np.empty((self.m, n_centroids, sub_dim), dtype=np.float32)
+        for j in range(self.m):
+            kmeans = KMeans(n_clusters=n_centroids, n_init=1, max_iter=25, random_state=0)
+            kmeans.fit(vectors[:, j * sub_dim:(j + 1) * sub_dim])
+            centroids[j] = kmeans.cluster_centers_
+        self.centroids = centroids
+        print(f"✓ Trained PQ quantizer ({self.m} x {n_centroids}) on {len(vectors)} vectors")
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    def set_state(self, state: Dict[str, np.ndarray], dimension: int) -> bool:
+        """Adopt a saved state; False if it was trained with another m or dimension"""
+        centroids = state["centroids"]
+        if centroids.ndim != 3 or centroids.shape[0] != self.m or self.m * centroids.shape[2] != dimension:
+            return False
+        self.centroids = centroids.astype(np.float32)
+        return True
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.reshape(len(vectors), self.m, -1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for start in range(0, len(vectors), SCAN_ROWS):
+            subs = self._split(vectors[start:start + SCAN_ROWS])
+            for j in range(self.m):
+                # argmin ||x - c||^2 == argmin (||c||^2 - 2 x.c)
+                c = self.centroids[j]
+                dist = (c * c).sum(axis=1) - 2 * subs[:, j] @ c.T
+                codes[start:start + len(subs), j] = dist.argmin(axis=1)
+        return codes
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate inner products via lookup tables, shape (n_queries, n_codes)"""
+        # tables[q, j, c] = query sub-vector j . centroid c of subspace j
+        tables = np.einsum("qjd,jcd->qjc", self._split(queries), self.centroids)
+        out = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for j in range(self.m):
+            out += tables[:, j, codes[:, j]]
+        return out
+
+
+class QuantizedIndex:
+    """Compressed copy of the store's rows, scanned to pick rerank candidates"""
+
+    def __init__(self, quantization: str, pq_m: int = 48):
+        if quantization == "int8":
+            self.quantizer = ScalarQuantizer()
+        elif quantization == "pq":
+            self.quantizer = ProductQuantizer(m=pq_m)
+        else:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATION_TYPES}")
+        self.quantization = quantization
+        self._codes: List[np.ndarray] = []
+
+    @property
+    def ntotal(self) -> int:
+        return sum(len(c) for c in self._codes)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in self._codes)
+
+    @property
+    def quantizer_id(self) -> str:
+        """Fingerprint of the trained quantizer, saved with codes it produced"""
+        digest = hashlib.sha1(self.quantization.encode("utf-8"))
+        for name, array in sorted(self.quantizer.get_state().items()):
+            digest.update(name.encode("utf-8"))
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()[:16]
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Codes of the rows, encoded SCAN_ROWS at a time"""
+        return np.concatenate([self.quantizer.encode(np.asarray(vectors[start:start + SCAN_ROWS]))
+                               for start in range(0, len(vectors), SCAN_ROWS)])
+
+    def add_codes(self, codes: np.ndarray):
+        """Append already encoded rows (kept in SCAN_ROWS blocks for the scan)"""
+        for start in range(0, len(codes), SCAN_ROWS):
+            self._codes.append(codes[start:start + SCAN_ROWS])
+
+    def add(self, vectors: np.ndarray):
+        if len(vectors) == 0:
+            return
+        if not self.quantizer.is_trained:
+            self.quantizer.train(np.asarray(vectors[:TRAIN_ROWS], dtype=np.float32))
+        self.add_codes(self.encode(vectors))
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate top-k (scores, ids) over the compressed rows"""
+        block_scores, block_ids = [], []
+        offset = 0
+        for codes in self._codes:
+            scores, ids = top_k(self.quantizer.scores(queries, codes), k)
+            block_scores.append(scores)
+            block_ids.append(ids + offset)
+            offset += len(codes)
+        return merge_top_k(block_scores, block_ids, k)
+
+
+def recall_at_k(exact_ids: np.ndarray, approx_ids: np.ndarray) -> float:
+    """Mean fraction of the exact top-k ids that the approximate top-k found"""
+    hits = [len(set(e) & set(a)) / max(len(e), 1) for e, a in zip(exact_ids, approx_ids)]
+    return float(np.mean(hits)) if hits else 0.0
@@ -0,0 +1,94 @@
+# src/reranker.py - CROSS-ENCODER RERANKING OF RETRIEVED CHUNKS
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+
+class CrossEncoderReranker:
+    """
+    Second-stage ranking of retrieved chunks with a small CPU cross-encoder.
+
+    The cross-encoder reads query and chunk together, which ranks better than
+    comparing two independent embeddings but costs a model pass per pair. So
+    pairs are scored in batches, in first-stage order, until the per-query
+    time budget runs out; chunks left unscored keep their first-stage order
+    behind the reranked ones. Pair scores are cached by (query hash, chunk
+    text hash), so repeated and follow-up questions over the same chunks
+    skip the model. Returned scores stay the first-stage similarities, so
+    thresholds and confidence scoring keep their meaning.
+    """
+
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 time_budget_ms: float = 300.0, batch_size: int = 8,
+                 cache_size: int = 10000, model=None):
+        self.model_name = model_name
+        self.time_budget_ms = time_budget_ms
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # model: any object with CrossEncoder's predict(pairs), used instead of loading model_name
+        self.model = model
+        if self.model is None:
+            try:
+                from sentence_transformers import CrossEncoder
+                self.model = CrossEncoder(model_name, device="cpu", max_length=256)
+                print(f"✓ Loaded reranker {model_name}")
+            except Exception as e:
+                print(f"⚠️ Reranker unavailable ({e}), keeping first-stage order")
+
+    @staticmethod
+    def _query_key(query: str) -> str:
+        return hashlib.sha1(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _chunk_key(document: str) -> str:
+        """Hash of the chunk text: a cached score can never be served for other text"""
+        return hashlib.sha1(document.encode("utf-8")).hexdigest()
+
+    def rerank(self, query: str, documents: List[str], metadatas: List[Dict],
+               scores: List[float]) -> Tuple[List[str], List[Dict], List[float]]:
+        """Reorder the hits by cross-encoder relevance, within the time budget"""
+        if self.model is None or len(documents) < 2:
+            return documents, metadatas, scores
+
+        query_key = self._query_key(query)
+        keys = [(query_key, self._chunk_key(doc)) for doc in documents]
+        with self._cache_lock:
+            pair_scores = [self._cache.get(key) for key in keys]
+            for key, score in zip(keys, pair_scores):
+                if score is not None:
+                    self._cache.move_to_end(key)
+        todo = [i for i, score in enumerate(pair_scores) if score is None]
+        self.hits += len(documents) - len(todo)
+
+        deadline = time.perf_counter() + self.time_budget_ms / 1000
+        for start in range(0, len(todo), self.batch_size):
+            if time.perf_counter() >= deadline:
+                break
+            batch = todo[start:start + self.batch_size]
+            values = self.model.predict([(query, documents[i]) for i in batch],
+                                        batch_size=self.batch_size, show_progress_bar=False)
+            with self._cache_lock:
+                for i, value in zip(batch, values):
+                    pair_scores[i] = float(value)
+                    self._cache[keys[i]] = pair_scores[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            self.misses += len(batch)
+
+        scored = sorted((i for i, s in enumerate(pair_scores) if s is not None),
+                        key=lambda i: pair_scores[i], reverse=True)
+        order = scored + [i for i, s in enumerate(pair_scores) if s is None]
+        return ([documents[i] for i in order], [metadatas[i] for i in order],
+                [scores[i] for i in order])
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
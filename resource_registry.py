@@ -0,0 +1,100 @@
+# src/resource_registry.py - PROCESS-WIDE SHARED MODELS AND COLLECTIONS
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable
+
+
+class ResourceRegistry:
+    """
+    Heavy objects (embedding models, collection managers) loaded once per
+    process and shared by every Streamlit session.
+
+    Streamlit re-runs app.py per interaction but keeps imported modules, so
+    the module-level `registry` below outlives sessions. Each key has its own
+    load lock, so two sessions asking for the same resource at once load it
+    once, without blocking unrelated loads. Shared resources are safe for
+    concurrent readers. Multi-step writes (delete the old version, then add
+    the new one) hold `writer(key)` so sessions do not interleave them.
+    """
+
+    def __init__(self):
+        self._resources: Dict[Hashable, object] = {}
+        self._load_locks: Dict[Hashable, threading.Lock] = {}
+        self._write_locks: Dict[Hashable, threading.RLock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, factory: Callable[[], object]):
+        """Return the resource for key, creating it with factory() on first use"""
+        resource = self._resources.get(key)
+        if resource is not None:
+            return resource
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            if key not in self._resources:
+                self._resources[key] = factory()
+                print(f"✓ Loaded shared resource {key}")
+            return self._resources[key]
+
+    @contextmanager
+    def writer(self, key: Hashable):
+        """Serialize multi-step writes to one resource across sessions"""
+        with self._lock:
+            lock = self._write_locks.setdefault(key, threading.RLock())
+        with lock:
+            yield
+
+    def drop(self, key: Hashable):
+        """Forget a resource (the next get() reloads it)"""
+        with self._lock:
+            resource = self._resources.pop(key, None)
+        if resource is not None and hasattr(resource, "close"):
+            resource.close()
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate bytes held by each loaded resource"""
+        return {str(key): _resource_bytes(resource) for key, resource in list(self._resources.items())}
+
+
+def _resource_bytes(resource) -> int:
+    if hasattr(resource, "memory_usage"):
+        usage = resource.memory_usage()
+        return int(sum(usage.values())) if isinstance(usage, dict) else int(usage)
+    if hasattr(resource, "nbytes"):
+        return int(resource.nbytes)
+    return sys.getsizeof(resource)
+
+
+# One registry per process
+registry = ResourceRegistry()
+
+
+def get_embedding_model(config):
+    """Shared EmbeddingGenerator for the configured backend, with the embedding cache"""
+    def load():
+        from embeddings import EmbeddingGenerator
+        from embedding_cache import EmbeddingCache
+        cache = EmbeddingCache(config.EMBEDDING_CACHE_DIR, config.EMBEDDING_CACHE_MAX_MB)
+        # Hashed term features by default, avoiding torch DLL issues; "torch"
+        # loads sentence-transformers, with ENCODE_WORKERS > 1 in a process pool
+        return EmbeddingGenerator(config.EMBEDDING_MODEL, use_torch=config.EMBEDDING_BACKEND == "torch",
+                                  cache=cache, n_workers=config.ENCODE_WORKERS, backend=config.EMBEDDING_BACKEND,
+                                  onnx_quantize=config.ONNX_QUANTIZE)
+    return registry.get(("embeddings", config.EMBEDDING_MODEL, config.EMBEDDING_BACKEND), load)
+
+
+def get_reranker(config):
+    """Shared cross-encoder reranker; its pair-score cache serves every session"""
+    def load():
+        from reranker import CrossEncoderReranker
+        return CrossEncoderReranker(config.RERANK_MODEL, time_budget_ms=config.RERANK_TIME_BUDGET_MS)
+    return registry.get(("reranker", config.RERANK_MODEL), load)
+
+
+def get_collections(config):
+    """Shared CollectionManager over config.PERSIST_DIRECTORY"""
+    def load():
+        from collection_manager import CollectionManager
+        return CollectionManager.from_config(config)
+    return registry.get(("collections", config.PERSIST_DIRECTORY), load)
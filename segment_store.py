@@ -0,0 +1,488 @@
+# src/segment_store.py - APPEND-ONLY SEGMENT FILES FOR THE VECTOR STORE
+import os
+import json
+import numpy as np
+import scipy.sparse as sp
+from typing import List, Dict, Optional, Tuple, Union
+
+from chunk_store import ChunkBlockFile, JsonLinesFile, write_chunk_blocks, write_json_lines, NPY_LOAD_LOCK
+from metadata_index import MetadataIndex
+from sparse_index import term_counts
+from token_counter import count_tokens, tokenizer_name
+
+FORMAT_VERSION = 2
+
+# Numbered manifests kept for read-only access and rollback; files only
+# referenced by older versions are deleted when those versions are pruned
+KEEP_VERSIONS = 5
+
+# Every file a segment may own; .chunks.jsonl is the pre-compression format
+SEGMENT_SUFFIXES = (".f32", ".f16", ".chunks.z", ".chunks.idx", ".chunks.jsonl", ".meta.jsonl",
+                    ".meta.offsets.npy", ".cols.npy", ".cols.json", ".terms.npz", ".int8.npz", ".pq.npz")
+
+# Row storage types, by the file suffix of their embedding segments
+DTYPE_SUFFIXES = {"float32": ".f32", "float16": ".f16"}
+
+# Size-tiered merging: MERGE_FACTOR adjacent segments of about the same size
+# are rewritten as one, so a store of n rows keeps O(MERGE_FACTOR * log n)
+# segments however small its uploads; segments reaching MERGE_MAX_ROWS stay
+MERGE_FACTOR = 10
+MERGE_MAX_ROWS = 1_000_000
+
+
+def plan_merges(segments: List[Dict]) -> List[Tuple[int, int]]:
+    """[start, end) ranges of adjacent segments to merge, in order.
+    
+    A range starts at a segment and takes the MERGE_FACTOR segments that
+    follow it in the same size tier (rows within a factor of MERGE_FACTOR)
+    or below, so a merged segment lands at most one tier up.
+    """
+    tiers = [int(np.log(max(segment["rows"], 1)) / np.log(MERGE_FACTOR)) for segment in segments]
+    merges, start = [], 0
+    while start + MERGE_FACTOR <= len(segments):
+        end, rows = start, 0
+        while (end < len(segments) and end - start < MERGE_FACTOR and tiers[end] <= tiers[start]
+               and rows + segments[end]["rows"] <= MERGE_MAX_ROWS):
+            rows += segments[end]["rows"]
+            end += 1
+        if end - start == MERGE_FACTOR:
+            merges.append((start, end))
+            start = end
+        else:
+            start += 1
+    return merges
+
+
+def _fsync_file(path: str):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(path: str):
+    """Make a rename durable (directories cannot be opened on Windows)"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SegmentStore:
+    """
+    On-disk layout used by SimpleVectorStore:
+
+        persist_dir/manifest.json              current segment list (rows and embedding model of each)
+        persist_dir/versions/manifest_000007.json    numbered snapshots of the manifest
+        persist_dir/wal.jsonl                  segments appended since the last manifest
+        persist_dir/segments/seg_000000.f32    raw float32 rows (.f16 for float16), opened with np.memmap
+        persist_dir/segments/seg_000000.chunks.z     zlib-compressed chunk text blocks
+        persist_dir/segments/seg_000000.chunks.idx   block offsets into .chunks.z
+        persist_dir/segments/seg_000000.meta.jsonl   metadata dicts, one per line
+        persist_dir/segments/seg_000000.meta.offsets.npy   line offsets into .meta.jsonl
+        persist_dir/segments/seg_000000.cols.npy     MetadataIndex columns (int32, memory-mappable)
+        persist_dir/segments/seg_000000.cols.json    field names, string code tables and tokenizer for .cols.npy
+        persist_dir/segments/seg_000000.terms.npz    hashed term counts for BM25
+        persist_dir/segments/seg_000000.pq.npz       quantized codes (.int8.npz for int8) and their quantizer id
+        persist_dir/tombstones_000001.bin      packed bitmap of deleted rows
+        persist_dir/indexes/hnsw.faiss         saved ANN index (hnsw or ivf), rebuilt when missing
+        persist_dir/indexes/hnsw.json          segments and rows the saved index covers
+        persist_dir/indexes/pq.quantizer.npz   trained int8 scales or PQ centroids
+
+    Adding documents writes one new segment and rewrites only the small
+    manifest, so ingest cost is proportional to the batch, not the store.
+    Compaction merges runs of small segments (see plan_merges) so many small
+    uploads do not leave thousands of files behind.
+
+    Crash safety: segment files are fsynced, then recorded in the write-ahead
+    log, then a new numbered manifest is written with write-then-rename. A
+    crash before the manifest lands is repaired on the next open by replaying
+    the log, so finished segments are never re-embedded. Passing `version`
+    opens that snapshot read-only.
+    """
+
+    MANIFEST = "manifest.json"
+    WAL = "wal.jsonl"
+
+    def __init__(self, persist_dir: str, version: Optional[int] = None, dtype: Optional[str] = None):
+        self.persist_dir = persist_dir
+        self.segment_dir = os.path.join(persist_dir, "segments")
+        self.version_dir = os.path.join(persist_dir, "versions")
+        self.read_only = version is not None
+        if not self.read_only:
+            os.makedirs(self.segment_dir, exist_ok=True)
+            os.makedirs(self.version_dir, exist_ok=True)
+        self.manifest = self._read_manifest(version)
+        # dtype applies to new stores; existing ones keep the dtype they were written with
+        if dtype is not None and dtype not in DTYPE_SUFFIXES:
+            raise ValueError(f"dtype must be one of {list(DTYPE_SUFFIXES)}, got '{dtype}'")
+        if not self.exists:
+            self.manifest["dtype"] = dtype or "float32"
+        elif dtype is not None and dtype != self.manifest["dtype"]:
+            print(f"⚠️ Store holds {self.manifest['dtype']} rows, ignoring dtype={dtype}")
+
+        if not self.read_only and self.exists:
+            if not self.versions():
+                # Store written before versioning: snapshot its current state
+                self._write_json(self._version_path(self.version), self.manifest)
+            self._replay_wal()
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.persist_dir, self.MANIFEST))
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.manifest["dtype"])
+
+    @property
+    def version(self) -> int:
+        return self.manifest["version"]
+
+    @property
+    def segments(self) -> List[Dict]:
+        return self.manifest["segments"]
+
+    @property
+    def dimension(self):
+        return self.manifest.get("dimension")
+
+    @property
+    def total_rows(self) -> int:
+        return sum(seg["rows"] for seg in self.segments)
+
+    @property
+    def model_ids(self) -> set:
+        """Embedding models of the segments; None stands for rows stored before models were recorded"""
+        return {seg.get("model_id") for seg in self.segments}
+
+    def versions(self) -> List[int]:
+        """Snapshot numbers that can be opened, oldest first"""
+        if not os.path.isdir(self.version_dir):
+            return []
+        return sorted(int(name[len("manifest_"):-len(".json")]) for name in os.listdir(self.version_dir)
+                      if name.startswith("manifest_") and name.endswith(".json"))
+
+    def _version_path(self, version: int) -> str:
+        return os.path.join(self.version_dir, f"manifest_{version:06d}.json")
+
+    def _read_manifest(self, version: Optional[int] = None) -> Dict:
+        if version is not None:
+            path = self._version_path(version)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Version {version} not found in {self.persist_dir}, "
+                                        f"available: {self.versions()}")
+        else:
+            path = os.path.join(self.persist_dir, self.MANIFEST)
+            if not os.path.exists(path):
+                return {"format": FORMAT_VERSION, "version": 0, "dimension": None, "segments": [],
+                        "next_segment": 0, "tombstones": None, "dtype": "float32"}
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("version", 0)
+        manifest.setdefault("next_segment", len(manifest["segments"]))
+        manifest.setdefault("tombstones", None)
+        manifest.setdefault("dtype", "float32")
+        return manifest
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"Version {self.version} of {self.persist_dir} is opened read-only")
+
+    def _write_manifest(self):
+        """Commit the in-memory manifest as the next numbered version"""
+        self._check_writable()
+        self.manifest["format"] = FORMAT_VERSION
+        self.manifest["version"] += 1
+        self._write_json(self._version_path(self.version), self.manifest)
+        self._write_json(os.path.join(self.persist_dir, self.MANIFEST), self.manifest)
+        # Everything the log recorded is now in the manifest
+        open(os.path.join(self.persist_dir, self.WAL), "w").close()
+        self._prune_versions()
+
+    @staticmethod
+    def _write_json(path: str, data: Dict):
+        # Write-then-rename so a crash never leaves a half-written manifest
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_dir(os.path.dirname(path))
+
+    def _log_append(self, segment: Dict):
+        """Durably record a fully written segment before the manifest names it"""
+        record = {"op": "append", "segment": segment, "dimension": self.dimension,
+                  "next_segment": self.manifest["next_segment"]}
+        with open(os.path.join(self.persist_dir, self.WAL), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay_wal(self):
+        """Commit segments that were logged but never reached the manifest"""
+        path = os.path.join(self.persist_dir, self.WAL)
+        if not os.path.exists(path):
+            return
+        known = {seg["name"] for seg in self.segments}
+        replayed = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn last record: the crash hit mid-write
+                segment = record["segment"]
+                if segment["name"] in known:
+                    continue
+                if not self._segment_complete(segment, record["dimension"]):
+                    break
+                self.segments.append(segment)
+                known.add(segment["name"])
+                self.manifest["dimension"] = record["dimension"]
+                self.manifest["next_segment"] = max(self.manifest["next_segment"], record["next_segment"])
+                replayed += 1
+        if replayed:
+            self._write_manifest()
+            print(f"✓ Replayed {replayed} segments from the write-ahead log")
+
+    def _segment_complete(self, segment: Dict, dimension: int) -> bool:
+        rows = self.embedding_path(segment)
+        return (os.path.exists(rows) and os.path.getsize(rows) == segment["rows"] * dimension * self.dtype.itemsize
+                and os.path.exists(self._path(segment["name"], ".chunks.idx"))
+                and os.path.exists(self._path(segment["name"], ".meta.jsonl")))
+
+    def _referenced_files(self, manifest: Dict) -> set:
+        names = {seg["name"] for seg in manifest["segments"]}
+        if manifest.get("tombstones"):
+            names.add(manifest["tombstones"])
+        return names
+
+    def _prune_versions(self):
+        """Drop old snapshots and the files that only they referenced"""
+        versions = self.versions()
+        if len(versions) <= KEEP_VERSIONS:
+            return
+        kept = set()
+        for version in versions[-KEEP_VERSIONS:]:
+            kept |= self._referenced_files(self._read_manifest(version))
+        for version in versions[:-KEEP_VERSIONS]:
+            for name in self._referenced_files(self._read_manifest(version)) - kept:
+                self._remove_files(name)
+            os.remove(self._version_path(version))
+
+    def _remove_files(self, name: str):
+        paths = [os.path.join(self.persist_dir, name)]
+        paths += [self._path(name, suffix) for suffix in SEGMENT_SUFFIXES]
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def restore(self, version: int):
+        """Make an older snapshot current again (as a new version)"""
+        self._check_writable()
+        manifest = self._read_manifest(version)
+        manifest["version"] = self.version
+        manifest["next_segment"] = max(manifest["next_segment"], self.manifest["next_segment"])
+        self.manifest = manifest
+        self._write_manifest()
+        print(f"✓ Restored version {version} as version {self.version}")
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.segment_dir, name + suffix)
+
+    def append(self, embeddings: np.ndarray, metadatas: List[Dict], chunks: List[str],
+               tokens: Optional[np.ndarray] = None, model_id: Optional[str] = None) -> Dict:
+        """Write a new segment and commit it to the manifest"""
+        segment = self.write_segment(embeddings, metadatas, chunks, tokens, model_id=model_id)
+        self._log_append(segment)
+        self.segments.append(segment)
+        self._write_manifest()
+        return segment
+
+    def write_segment(self, embeddings: np.ndarray, metadatas: List[Dict], chunks: List[str],
+                      tokens: Optional[np.ndarray] = None, tokenizer: Optional[str] = None,
+                      model_id: Optional[str] = None) -> Dict:
+        """Write segment files (fsynced) without committing them to the manifest.
+        
+        `tokenizer` names what produced `tokens` (default: the current
+        count_tokens), so estimated counts can be recounted later.
+        `model_id` names the embedding model, recorded with the segment.
+        """
+        self._check_writable()
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        name = f"seg_{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        rows_suffix = DTYPE_SUFFIXES[self.manifest["dtype"]]
+
+        embeddings.tofile(self._path(name, rows_suffix))
+        write_chunk_blocks(self._path(name, ".chunks.z"), self._path(name, ".chunks.idx"), chunks)
+        write_json_lines(self._path(name, ".meta.jsonl"), self._path(name, ".meta.offsets.npy"), metadatas)
+        # Term counts are computed at ingest, so the BM25 index loads without re-tokenizing
+        sp.save_npz(self._path(name, ".terms.npz"), term_counts(chunks), compressed=False)
+        for suffix in (rows_suffix, ".chunks.z", ".chunks.idx", ".meta.jsonl", ".meta.offsets.npy", ".terms.npz"):
+            _fsync_file(self._path(name, suffix))
+        if tokens is None:
+            tokens = count_tokens(chunks)
+        rows, info = MetadataIndex.encode(metadatas, tokens)
+        info["tokenizer"] = tokenizer or tokenizer_name()
+        self.save_columns(name, rows, info)
+
+        self.manifest["dimension"] = int(embeddings.shape[1])
+        segment = {"name": name, "rows": len(embeddings)}
+        if model_id is not None:
+            segment["model_id"] = model_id
+        return segment
+
+    def save_columns(self, name: str, rows: np.ndarray, info: Dict):
+        """(Re)write a segment's metadata columns; each file is replaced atomically"""
+        tmp_path = self._path(name, ".cols.tmp.npy")
+        np.save(tmp_path, rows)
+        _fsync_file(tmp_path)
+        os.replace(tmp_path, self._path(name, ".cols.npy"))
+        self._write_json(self._path(name, ".cols.json"), info)
+
+    def read_columns(self, segment: Dict) -> Optional[Tuple[np.ndarray, Dict]]:
+        """Memory-mapped metadata columns and their info, or None for older segments"""
+        info_path = self._path(segment["name"], ".cols.json")
+        if not os.path.exists(info_path):
+            return None
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        with NPY_LOAD_LOCK:
+            return np.load(self._path(segment["name"], ".cols.npy"), mmap_mode="r"), info
+
+    def commit_segments(self, segments: List[Dict]):
+        """Atomically swap in a new segment list (used by compaction).
+
+        Tombstones refer to old row numbers, so they are cleared in the same
+        manifest write. Replaced files stay until their versions are pruned.
+        """
+        self.manifest["segments"] = segments
+        self.manifest["tombstones"] = None
+        self._write_manifest()
+
+    def write_tombstones(self, deleted: np.ndarray):
+        """Persist the deleted-row bitmap under a new name, then commit it"""
+        self._check_writable()
+        name = f"tombstones_{self.manifest['next_segment']:06d}.bin"
+        self.manifest["next_segment"] += 1
+        path = os.path.join(self.persist_dir, name)
+        np.packbits(deleted).tofile(path)
+        _fsync_file(path)
+        self.manifest["tombstones"] = name
+        self._write_manifest()
+
+    def read_tombstones(self):
+        """Deleted-row bitmap, or None when nothing has been deleted"""
+        name = self.manifest["tombstones"]
+        if name is None:
+            return None
+        packed = np.fromfile(os.path.join(self.persist_dir, name), dtype=np.uint8)
+        return np.unpackbits(packed, count=self.total_rows).astype(bool)
+
+    def index_paths(self, index_type: str) -> Tuple[str, str]:
+        """(index file, info file) of a saved ANN index"""
+        base = os.path.join(self.persist_dir, "indexes", index_type)
+        return base + ".faiss", base + ".json"
+
+    def save_index(self, index, index_type: str, info: Dict):
+        """Replace the saved ANN index; the info file is written last"""
+        self._check_writable()
+        index_path, info_path = self.index_paths(index_type)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp_path = index_path + ".tmp"
+        index.save(tmp_path)
+        _fsync_file(tmp_path)
+        os.replace(tmp_path, index_path)
+        self._write_json(info_path, info)
+
+    def read_index_info(self, index_type: str) -> Optional[Dict]:
+        """What the saved ANN index covers, or None when there is none"""
+        index_path, info_path = self.index_paths(index_type)
+        if not (os.path.exists(index_path) and os.path.exists(info_path)):
+            return None
+        with open(info_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _quantizer_path(self, quantization: str) -> str:
+        return os.path.join(self.persist_dir, "indexes", f"{quantization}.quantizer.npz")
+
+    def save_quantizer(self, quantization: str, state: Dict[str, np.ndarray]):
+        """Replace the saved quantizer state (int8 scales or PQ centroids)"""
+        self._check_writable()
+        path = self._quantizer_path(quantization)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **state)
+        _fsync_file(tmp_path)
+        os.replace(tmp_path, path)
+
+    def read_quantizer(self, quantization: str) -> Optional[Dict[str, np.ndarray]]:
+        path = self._quantizer_path(quantization)
+        if not os.path.exists(path):
+            return None
+        with NPY_LOAD_LOCK, np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def save_codes(self, segment: Dict, quantization: str, codes: np.ndarray, quantizer_id: str):
+        """Save a segment's quantized codes, tagged with the quantizer that made them"""
+        self._check_writable()
+        path = self._path(segment["name"], f".{quantization}.npz")
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, codes=codes, quantizer_id=np.array(quantizer_id))
+        _fsync_file(tmp_path)
+        os.replace(tmp_path, path)
+
+    def read_codes(self, segment: Dict, quantization: str, quantizer_id: str) -> Optional[np.ndarray]:
+        """A segment's saved codes, or None if missing or made by another quantizer"""
+        path = self._path(segment["name"], f".{quantization}.npz")
+        if not os.path.exists(path):
+            return None
+        with NPY_LOAD_LOCK, np.load(path) as data:
+            if str(data["quantizer_id"]) != quantizer_id:
+                return None
+            codes = data["codes"]
+        return codes if len(codes) == segment["rows"] else None
+
+    def embedding_path(self, segment: Dict) -> str:
+        return self._path(segment["name"], DTYPE_SUFFIXES[self.manifest["dtype"]])
+
+    def open_embeddings(self, segment: Dict) -> np.ndarray:
+        """Memory-map a segment's rows read-only (no data is read until touched)"""
+        return np.memmap(self.embedding_path(segment), dtype=self.dtype, mode="r",
+                         shape=(segment["rows"], self.dimension))
+
+    def open_chunks(self, segment: Dict) -> Union[ChunkBlockFile, List[str]]:
+        """Lazy reader over the segment's chunk blocks (legacy segments load eagerly)"""
+        if os.path.exists(self._path(segment["name"], ".chunks.z")):
+            return ChunkBlockFile(self._path(segment["name"], ".chunks.z"),
+                                  self._path(segment["name"], ".chunks.idx"), segment["rows"])
+        with open(self._path(segment["name"], ".chunks.jsonl"), "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def read_terms(self, segment: Dict) -> Optional[sp.csr_matrix]:
+        """The segment's term counts, or None for segments written before BM25"""
+        path = self._path(segment["name"], ".terms.npz")
+        if not os.path.exists(path):
+            return None
+        with NPY_LOAD_LOCK:
+            return sp.load_npz(path).tocsr()
+
+    def open_metadatas(self, segment: Dict) -> JsonLinesFile:
+        """Lazy reader over the segment's metadata dicts"""
+        return JsonLinesFile(self._path(segment["name"], ".meta.jsonl"),
+                             self._path(segment["name"], ".meta.offsets.npy"))
+
+    def read_chunks(self, segment: Dict) -> List[str]:
+        """All chunk texts of a segment, in row order"""
+        chunks = self.open_chunks(segment)
+        if isinstance(chunks, list):
+            return chunks
+        return [text for block in range(len(chunks.offsets) - 1) for text in chunks.read_block(block)]
+
+    def read_metadatas(self, segment: Dict) -> List[Dict]:
+        with open(self._path(segment["name"], ".meta.jsonl"), "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
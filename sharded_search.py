@@ -0,0 +1,110 @@
+# src/sharded_search.py - MULTI-PROCESS EXACT SEARCH OVER MEMORY-MAPPED SEGMENTS
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from vector_index import top_k, merge_top_k
+from quantization import SCAN_ROWS
+
+# Per-worker cache of opened segment memmaps, keyed by file path
+_WORKER_SEGMENTS: Dict[str, np.ndarray] = {}
+
+
+def _init_worker():
+    """Limit each worker to one BLAS thread so N shards use N cores, not N * cores"""
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def _open_segment(path: str, rows: int, dimension: int, dtype: str) -> np.ndarray:
+    segment = _WORKER_SEGMENTS.get(path)
+    if segment is None or len(segment) != rows:
+        segment = np.memmap(path, dtype=dtype, mode="r", shape=(rows, dimension))
+        _WORKER_SEGMENTS[path] = segment
+    return segment
+
+
+def _search_shard(pieces: List[Tuple], dimension: int, dtype: str, queries: np.ndarray, k: int,
+                  tombstones: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact top-k over one shard; runs inside a worker process.
+
+    `pieces` are (path, segment_rows, start, end, global_offset) row ranges,
+    `tombstones` is the shard's slice of the deleted-row bitmap (or None).
+    float16 rows are upcast SCAN_ROWS at a time.
+    """
+    step = None if dtype == "float32" else SCAN_ROWS
+    block_scores, block_ids = [], []
+    shard_offset = 0
+    for path, rows, start, end, global_offset in pieces:
+        segment = _open_segment(path, rows, dimension, dtype)
+        for lo in range(start, end, step or end - start):
+            hi = min(end, lo + (step or end - start))
+            similarities = queries @ np.asarray(segment[lo:hi], dtype=np.float32).T
+            if tombstones is not None:
+                local = shard_offset + lo - start
+                similarities[:, tombstones[local:local + hi - lo]] = -np.inf
+            scores, ids = top_k(similarities, k)
+            block_scores.append(scores)
+            block_ids.append(ids + global_offset + lo - start)
+        shard_offset += end - start
+    return merge_top_k(block_scores, block_ids, k)
+
+
+class ShardedSearcher:
+    """
+    Splits the persisted rows into `n_shards` contiguous ranges, each scored
+    by a worker process that memory-maps the segment files itself (the OS
+    page cache is shared, nothing is copied between processes). Per-shard
+    top-k lists are merged in the parent, which gives the same hits as a
+    single-process scan.
+    """
+
+    def __init__(self, segment_store, n_shards: int):
+        self.segment_store = segment_store
+        self.n_shards = n_shards
+        self._pool = None
+
+    def _shards(self) -> List[List[Tuple]]:
+        """Cut the segment list into n_shards row ranges of near-equal size"""
+        total = self.segment_store.total_rows
+        bounds = np.linspace(0, total, self.n_shards + 1).astype(int)
+        shards = [[] for _ in range(self.n_shards)]
+        seg_start = 0
+        for segment in self.segment_store.segments:
+            path = self.segment_store.embedding_path(segment)
+            seg_end = seg_start + segment["rows"]
+            for s in range(self.n_shards):
+                lo, hi = max(seg_start, bounds[s]), min(seg_end, bounds[s + 1])
+                if lo < hi:
+                    shards[s].append((path, segment["rows"], lo - seg_start, hi - seg_start, lo))
+            seg_start = seg_end
+        return [pieces for pieces in shards if pieces]
+
+    def search(self, queries: np.ndarray, k: int,
+               tombstones: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Scatter the queries to every shard, gather and merge the top-k"""
+        if self._pool is None:
+            # spawn: forking the threaded app process (Streamlit, hybrid search,
+            # background compaction) can copy held locks into the workers
+            self._pool = ProcessPoolExecutor(max_workers=self.n_shards,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker)
+
+        futures = []
+        for pieces in self._shards():
+            shard_tombstones = None
+            if tombstones is not None:
+                shard_tombstones = tombstones[pieces[0][4]:pieces[-1][4] + pieces[-1][3] - pieces[-1][2]]
+            futures.append(self._pool.submit(_search_shard, pieces, self.segment_store.dimension,
+                                             self.segment_store.dtype.name, queries, k, shard_tombstones))
+        results = [future.result() for future in futures]
+        return merge_top_k([r[0] for r in results], [r[1] for r in results], k)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
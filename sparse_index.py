@@ -0,0 +1,114 @@
+# src/sparse_index.py - INVERTED INDEX FOR LEXICAL (BM25) SEARCH
+import numpy as np
+import scipy.sparse as sp
+from typing import List, Optional, Tuple
+
+from vector_index import top_k
+
+# Hash buckets for terms: large enough that distinct words rarely collide
+N_FEATURES = 2 ** 20
+
+_VECTORIZER = None
+
+
+def term_counts(texts: List[str]) -> sp.csr_matrix:
+    """Raw term counts per text, hashed into N_FEATURES columns (stateless)"""
+    global _VECTORIZER
+    if _VECTORIZER is None:
+        from sklearn.feature_extraction.text import HashingVectorizer
+        # token_pattern keeps one-character tokens so codes like "A-7" still match
+        _VECTORIZER = HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm=None,
+                                        stop_words='english', token_pattern=r"(?u)\b\w+\b",
+                                        dtype=np.float32)
+    counts = _VECTORIZER.transform(texts).tocsr()
+    counts.sum_duplicates()
+    return counts
+
+
+class SparseIndex:
+    """
+    BM25 over per-block inverted indexes of hashed term counts.
+
+    Terms are hashed rather than fit to a vocabulary, so every term is kept
+    and nothing needs refitting as documents arrive. Each add() appends one
+    term-major (CSC) block. Its columns are posting lists, so a query reads
+    only its own terms' postings. Trailing blocks are merged while the older
+    one is no bigger than the newer (like a binary counter), so many small
+    ingest batches leave O(log n) blocks and each row is re-merged only
+    O(log n) times. IDF and average document length are global and applied
+    at query time, which keeps scores exact as the index grows.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_freq = np.zeros(N_FEATURES, dtype=np.int64)
+        self.doc_len = np.empty(0, dtype=np.float32)
+        self.ntotal = 0
+        self._blocks: List[Tuple[int, sp.csc_matrix]] = []  # (row offset, postings)
+
+    @property
+    def nbytes(self) -> int:
+        return self.doc_freq.nbytes + self.doc_len.nbytes + sum(
+            m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for _, m in self._blocks)
+
+    def add(self, texts: List[str]):
+        self.add_counts(term_counts(texts))
+
+    def add_counts(self, counts: sp.csr_matrix):
+        """Append rows given as precomputed term counts (see term_counts)"""
+        if counts.shape[0] == 0:
+            return
+        self.doc_freq += np.bincount(counts.indices, minlength=N_FEATURES)
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(counts.sum(axis=1), np.float32).ravel()])
+        self._blocks.append((self.ntotal, counts.tocsc()))
+        self.ntotal += counts.shape[0]
+        while len(self._blocks) >= 2 and self._blocks[-2][1].shape[0] <= self._blocks[-1][1].shape[0]:
+            (offset, older), (_, newer) = self._blocks[-2:]
+            self._blocks[-2:] = [(offset, sp.vstack([older, newer], format="csc"))]
+
+    def _postings(self, terms: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Concatenated (rows, term frequencies, term positions in `terms`) over all blocks"""
+        rows, tfs, which = [], [], []
+        for offset, block in self._blocks:
+            starts, ends = block.indptr[terms], block.indptr[terms + 1]
+            for j in np.flatnonzero(ends > starts):
+                rows.append(block.indices[starts[j]:ends[j]] + offset)
+                tfs.append(block.data[starts[j]:ends[j]])
+                which.append(np.full(ends[j] - starts[j], j, dtype=np.int32))
+        if not rows:
+            return np.empty(0, np.int64), np.empty(0, np.float32), np.empty(0, np.int32)
+        return np.concatenate(rows), np.concatenate(tfs), np.concatenate(which)
+
+    def search(self, queries: List[str], k: int,
+               row_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 top-k per query text; rows sharing no query term get id -1"""
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.ntotal == 0:
+            return all_scores, all_ids
+        avg_len = max(float(self.doc_len.mean()), 1e-9)
+
+        query_counts = term_counts(queries)
+        for i in range(len(queries)):
+            terms = query_counts.indices[query_counts.indptr[i]:query_counts.indptr[i + 1]]
+            rows, tf, which = self._postings(terms)
+            if len(rows) == 0:
+                continue
+            df = self.doc_freq[terms]
+            idf = np.log(1 + (self.ntotal - df + 0.5) / (df + 0.5)).astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows] / avg_len)
+            weights = idf[which] * tf * (self.k1 + 1) / (tf + norm)
+
+            # Sum per row over the candidate rows only, never a full-length array
+            candidates, inverse = np.unique(rows, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights).astype(np.float32)
+            if row_mask is not None:
+                keep = row_mask[candidates]
+                candidates, scores = candidates[keep], scores[keep]
+            if len(candidates) == 0:
+                continue
+            top_scores, top = top_k(scores.reshape(1, -1), k)
+            all_scores[i, :top.shape[1]] = top_scores[0]
+            all_ids[i, :top.shape[1]] = candidates[top[0]]
+        return all_scores, all_ids
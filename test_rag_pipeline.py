@@ -1,8 +1,22 @@
 # test_rag_pipeline.py
 import pytest
-from src.document_processor import DocumentProcessor
-from src.intelligent_chunker import IntelligentChunker
-from src.embeddings import EmbeddingGenerator
+import numpy as np
+from document_processor import DocumentProcessor
+from intelligent_chunker import IntelligentChunker
+from embeddings import EmbeddingGenerator
+from vector_store import SimpleVectorStore
+
+@pytest.fixture
+def make_store(tmp_path):
+    """Factory for stores under tmp_path, optionally filled with one batch of rows"""
+    def make(name="", embeddings=None, metadatas=None, chunks=None, **store_kwargs):
+        store = SimpleVectorStore(str(tmp_path / name), **store_kwargs)
+        if embeddings is not None:
+            store.add_documents(embeddings,
+                                [{}] * len(embeddings) if metadatas is None else metadatas,
+                                [str(i) for i in range(len(embeddings))] if chunks is None else chunks)
+        return store
+    return make
 
 def test_document_processing():
     """Test PDF text extraction"""
@@ -32,10 +46,613 @@ def test_embeddings():
     assert embeddings.shape[0] == 2
     assert embeddings.shape[1] == 384  # all-MiniLM-L6-v2 dimension
 
-def test_dynamic_retrieval():
-    """Test retrieval logic"""
-    # Mock test - would need actual vector store
-    pass
+def test_embeddings_share_one_space_across_batches():
+    """Batches embedded separately and queries land in the same vector space"""
+    embedder = EmbeddingGenerator()
+    first, _ = embedder.generate_embeddings([("solar panels convert sunlight", {})])
+    embedder.generate_embeddings([("an unrelated later upload about tax law", {})])
+    again, _ = embedder.generate_embeddings([("solar panels convert sunlight", {})])
+    assert np.allclose(first, again)
+    assert np.allclose(embedder.embed_query("solar panels convert sunlight"), first[0])
+
+def test_embed_query_lru_is_bounded_and_keyed_by_model():
+    """Repeated queries are served from the LRU; the oldest entries are evicted"""
+    embedder = EmbeddingGenerator(query_cache_size=2)
+    first = embedder.embed_query("what is  the deadline?")
+    assert np.array_equal(embedder.embed_query("what is the deadline? "), first)
+    assert (embedder.query_hits, embedder.query_misses) == (1, 1)
+
+    embedder.embed_query("q2")
+    embedder.embed_query("q3")
+    embedder.embed_query("what is the deadline?")
+    assert embedder.query_misses == 4
+    assert len(embedder._query_cache) == 2
+
+def test_iter_embeddings_streams_float32_batches():
+    """Streaming in batches gives the same vectors as one big call"""
+    embedder = EmbeddingGenerator()
+    chunks = [(f"chunk number {i}", {"chunk_id": i}) for i in range(10)]
+    batches = list(embedder.iter_embeddings(chunks, batch_size=4))
+
+    assert [len(texts) for _, _, texts in batches] == [4, 4, 2]
+    assert all(e.dtype == np.float32 and e.flags["C_CONTIGUOUS"] for e, _, _ in batches)
+    assert np.allclose(np.vstack([e for e, _, _ in batches]), embedder.generate_embeddings(chunks)[0])
+    assert [m["chunk_id"] for _, metas, _ in batches for m in metas] == list(range(10))
+
+def test_encode_pool_matches_single_process():
+    """Pooled sentence-transformers encoding returns the in-process vectors, in order"""
+    pytest.importorskip("sentence_transformers")
+    chunks = [(f"sentence {i} " * (i % 7 + 1), {}) for i in range(100)]
+    single = EmbeddingGenerator(use_torch=True)
+    pooled = EmbeddingGenerator(use_torch=True, n_workers=2)
+    try:
+        assert np.allclose(pooled.generate_embeddings(chunks)[0],
+                           single.generate_embeddings(chunks)[0], atol=1e-5)
+        assert pooled.pool.chunks_per_sec > 0
+    finally:
+        pooled.close()
+
+def test_onnx_backend_matches_torch(tmp_path):
+    """ONNX outputs match sentence-transformers; int8 stays close in cosine"""
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("sentence_transformers")
+    from onnx_encoder import OnnxEncoder
+    texts = ["The invoice is due on Friday.", "Solar panels convert sunlight into power.", "ok"]
+    expected = EmbeddingGenerator(use_torch=True).model.encode(texts, normalize_embeddings=True)
+
+    onnx = OnnxEncoder(model_dir=str(tmp_path)).encode(texts, normalize_embeddings=True)
+    assert np.allclose(onnx, expected, atol=1e-4)
+    int8 = OnnxEncoder(model_dir=str(tmp_path), quantize=True).encode(texts, normalize_embeddings=True)
+    assert np.min(np.sum(int8 * expected, axis=1)) > 0.98
+
+def test_embedding_cache_skips_already_embedded_chunks(tmp_path):
+    """Unchanged chunks come from the cache, and the cache stays under its size bound"""
+    from embedding_cache import EmbeddingCache
+    cache = EmbeddingCache(str(tmp_path), max_mb=0.01)
+    embedder = EmbeddingGenerator(cache=cache)
+    chunks = [(f"chunk number {i}", {}) for i in range(4)]
+
+    first, _ = embedder.generate_embeddings(chunks)
+    second, _ = embedder.generate_embeddings(chunks + [("a new chunk", {})])
+    assert np.allclose(first, second[:4])
+    assert (cache.hits, cache.misses) == (4, 5)
+
+    embedder.generate_embeddings([(f"filler {i}", {}) for i in range(20)])
+    assert cache.stats()["bytes"] <= 0.01 * 1024 * 1024
+
+def test_index_backends_match_exact_search(make_store):
+    """ANN backends return the same top hits as exact search on a small store"""
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((200, 384)).astype(np.float32)
+    chunks = [f"chunk {i}" for i in range(200)]
+    metadatas = [{"chunk_id": i} for i in range(200)]
+    query = embeddings[17] + 0.01
+
+    results = {}
+    for index_type in ["flat", "hnsw", "ivf"]:
+        store = make_store(index_type, embeddings, metadatas, chunks, index_type=index_type)
+        if index_type != "flat":
+            assert store.wait_for_index(timeout=60)
+        results[index_type] = store.similarity_search(query, k=5)
+
+    assert results["flat"][0][0] == "chunk 17"
+    for index_type in ["hnsw", "ivf"]:
+        assert results[index_type][0] == results["flat"][0]
+        assert np.allclose(results[index_type][2], results["flat"][2], atol=1e-5)
+
+def test_ann_index_is_saved_and_reloaded(tmp_path, make_store, capsys):
+    """The built HNSW index is saved, reopened without a rebuild and caught up with new rows"""
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((300, 32)).astype(np.float32)
+    store = make_store("", embeddings[:200], [{"chunk_id": i} for i in range(200)],
+                       [f"chunk {i}" for i in range(200)], index_type="hnsw")
+    # Exact search answers while the index is built in the background
+    assert store.similarity_search(embeddings[5], k=1)[0] == ["chunk 5"]
+    assert store.wait_for_index(timeout=60)
+    assert (tmp_path / "indexes" / "hnsw.faiss").exists()
+    store.close()
+
+    reopened = SimpleVectorStore(str(tmp_path), index_type="hnsw")
+    reopened.add_documents(embeddings[200:], [{"chunk_id": i} for i in range(200, 300)],
+                           [f"chunk {i}" for i in range(200, 300)])
+    assert reopened.wait_for_index(timeout=60)
+    assert "Loaded hnsw index with 200 rows" in capsys.readouterr().out
+    assert reopened._index_saved_rows == 300
+    assert reopened.similarity_search(embeddings[250], k=1)[0] == ["chunk 250"]
+
+    # A different configuration does not reuse the saved graph
+    other = SimpleVectorStore(str(tmp_path), index_type="hnsw", index_params={"m": 8})
+    assert other.wait_for_index(timeout=60)
+    assert other.similarity_search(embeddings[5], k=1)[0] == ["chunk 5"]
+
+def test_batch_search_matches_single_queries(make_store):
+    """similarity_search_batch returns the same hits as one query at a time"""
+    rng = np.random.default_rng(1)
+    store = make_store()
+    for start in range(0, 300, 100):
+        store.add_documents(rng.standard_normal((100, 32)),
+                            [{"chunk_id": i} for i in range(start, start + 100)],
+                            [f"chunk {i}" for i in range(start, start + 100)])
+    queries = rng.standard_normal((8, 32))
+
+    batch = store.similarity_search_batch(queries, k=7)
+    assert len(batch) == 8
+    for query, result in zip(queries, batch):
+        documents, _, scores = store.similarity_search(query, k=7)
+        assert result[0] == documents
+        assert np.allclose(result[2], scores, atol=1e-5)
+        assert result[2] == sorted(result[2], reverse=True)
+
+def test_filtered_search_only_scores_matching_rows(make_store):
+    """Metadata filters restrict results to the requested source and page range"""
+    rng = np.random.default_rng(2)
+    store = make_store()
+    for source in ["a.pdf", "b.pdf"]:
+        store.add_documents(rng.standard_normal((50, 16)),
+                            [{"source": source, "page": i // 5 + 1, "chunk_id": i} for i in range(50)],
+                            [f"{source} chunk {i}" for i in range(50)])
+    query = rng.standard_normal(16)
+
+    _, metadatas, _ = store.similarity_search(query, k=10, filter={"source": "b.pdf", "page": (2, 3)})
+    assert len(metadatas) == 10
+    assert all(m["source"] == "b.pdf" and 2 <= m["page"] <= 3 for m in metadatas)
+
+    documents, _, _ = store.similarity_search(query, k=10, filter={"source": "missing.pdf"})
+    assert documents == []
+
+    # Filtering on every row gives the same answer as no filter
+    unfiltered = store.similarity_search(query, k=5)
+    assert store.similarity_search(query, k=5, filter={"source": ["a.pdf", "b.pdf"]})[0] == unfiltered[0]
+
+def test_quantized_search_reranks_to_exact_scores(tmp_path, make_store, capsys):
+    """int8 and PQ first passes are reranked with the full-precision vectors"""
+    rng = np.random.default_rng(3)
+    embeddings = rng.standard_normal((400, 32)).astype(np.float32)
+    query = embeddings[5] + 0.05 * rng.standard_normal(32)
+
+    expected = make_store("exact", embeddings).similarity_search(query, k=3)
+
+    for quantization in ["int8", "pq"]:
+        store = make_store(quantization, embeddings, quantization=quantization, rerank_factor=10, pq_m=8)
+        # Exact search answers while the codes are trained in the background
+        assert store.similarity_search(query, k=3)[0] == expected[0] and store.quantized is None
+        assert store.wait_for_index(timeout=60)
+        documents, _, scores = store.similarity_search(query, k=3)
+        assert documents[0] == "5"
+        assert np.isclose(scores[0], expected[2][0], atol=1e-5)
+
+        # The quantizer and codes are saved: reopening neither retrains nor re-encodes
+        assert len(list((tmp_path / quantization).glob(f"segments/*.{quantization}.npz"))) == 1
+        capsys.readouterr()
+        reopened = SimpleVectorStore(store.persist_dir, quantization=quantization,
+                                     rerank_factor=10, pq_m=8)
+        assert reopened.wait_for_index(timeout=60)
+        assert reopened.similarity_search(query, k=3)[0] == documents
+        assert "Trained" not in capsys.readouterr().out
+        assert np.array_equal(np.vstack(reopened.quantized._codes), np.vstack(store.quantized._codes))
+
+def test_lexical_search_uses_full_vocabulary(make_store):
+    """Keyword search finds rare terms, respects filters and deletes, and grows incrementally"""
+    rng = np.random.default_rng(8)
+    texts = [f"routine filler text number {i}" for i in range(40)]
+    texts[7] = "the xylophone invoice is overdue"
+    store = make_store("", rng.standard_normal((40, 8)),
+                       [{"source": "a.pdf", "doc_hash": f"h{i}"} for i in range(40)], texts,
+                       compaction_threshold=1.0)
+
+    documents, _, scores = store.lexical_search("xylophone invoice", k=3)
+    assert documents == ["the xylophone invoice is overdue"] and scores[0] > 0
+    assert store.lexical_search("xylophone", k=3, filter={"source": "b.pdf"})[0] == []
+
+    store.add_documents(rng.standard_normal((1, 8)), [{"source": "b.pdf", "doc_hash": "new"}],
+                        ["another xylophone"])
+    store.delete("h7")
+    assert store.lexical_search("xylophone", k=3)[0] == ["another xylophone"]
+
+def test_hybrid_search_fuses_exact_terms_with_vectors(tmp_path, make_store):
+    """BM25 catches exact codes the vectors miss; persisted term counts serve reopened stores"""
+    from sparse_index import term_counts
+    rng = np.random.default_rng(10)
+    embeddings = rng.standard_normal((50, 16))
+    texts = [f"general maintenance note {i}" for i in range(50)]
+    texts[31] = "replace part A-7731 before shipping"
+    make_store("", embeddings, [{"doc_hash": f"h{i}"} for i in range(50)], texts)
+
+    reopened = SimpleVectorStore(str(tmp_path))
+    assert reopened.wait_for_index(timeout=60) and reopened.sparse.ntotal == 50  # built at open
+    assert (reopened.segment_store.read_terms(reopened.segment_store.segments[0]) != term_counts(texts)).nnz == 0
+    query = embeddings[3]  # dense neighbour is row 3, keyword match is row 31
+    documents, _, scores = reopened.hybrid_search("A-7731", query, k=2)
+    assert set(documents) == {texts[3], texts[31]}
+    assert np.isclose(scores[documents.index(texts[3])], 1.0, atol=1e-5)
+    assert reopened.lexical_search("a-7731", k=1)[0] == [texts[31]]
+    reopened.add_documents(rng.standard_normal((1, 16)), [{"doc_hash": "new"}], ["part B-1200"])
+    assert reopened.sparse.ntotal == 51  # extended at ingest, not on the next query
+
+def test_sparse_index_merges_small_blocks():
+    """Many small adds keep O(log n) posting blocks and score like one bulk add"""
+    from sparse_index import SparseIndex
+    rng = np.random.default_rng(13)
+    words = [f"term{i}" for i in range(50)]
+    texts = [" ".join(rng.choice(words, 8)) for _ in range(640)]
+    bulk, streamed = SparseIndex(), SparseIndex()
+    bulk.add(texts)
+    for start in range(0, len(texts), 10):
+        streamed.add(texts[start:start + 10])
+
+    assert len(streamed._blocks) <= 7  # log2(64 batches) + 1
+    queries = ["term3 term17", "term42"]
+    for expected, result in zip(bulk.search(queries, 5), streamed.search(queries, 5)):
+        assert np.allclose(expected, result)
+
+def test_float16_storage_halves_rows_and_keeps_hits(tmp_path, make_store):
+    """float16 stores persist half-size rows and rank like float32"""
+    rng = np.random.default_rng(9)
+    embeddings = rng.standard_normal((300, 32))
+    queries = embeddings[:5] + 0.1 * rng.standard_normal((5, 32))
+    stores = {}
+    for dtype in ["float32", "float16"]:
+        make_store(dtype, embeddings, dtype=dtype)
+        stores[dtype] = SimpleVectorStore(str(tmp_path / dtype))
+
+    assert stores["float16"].segments[0].dtype == np.float16
+    assert stores["float16"].memory_usage()["embeddings"] * 2 == stores["float32"].memory_usage()["embeddings"]
+    for expected, result in zip(stores["float32"].similarity_search_batch(queries, k=3),
+                                stores["float16"].similarity_search_batch(queries, k=3)):
+        assert result[0][0] == expected[0][0]
+        assert np.allclose(result[2], expected[2], atol=1e-2)
+
+def test_delete_replace_and_compact(tmp_path, make_store):
+    """Deleted documents disappear from search, survive reopen, and compact away"""
+    rng = np.random.default_rng(4)
+    embeddings = rng.standard_normal((60, 16))
+    store = make_store(compaction_threshold=1.0)
+    for j, doc_hash in enumerate(["h0", "h1", "h2"]):
+        store.add_documents(embeddings[j * 20:(j + 1) * 20],
+                            [{"doc_hash": doc_hash, "source": f"{doc_hash}.pdf"}] * 20,
+                            [f"{doc_hash}-{i}" for i in range(20)])
+
+    assert store.delete("h1") == 20
+    assert store.delete("h1") == 0
+    documents, _, _ = store.similarity_search(embeddings[25], k=10)
+    assert not any(doc.startswith("h1") for doc in documents)
+    assert store.sources() == ["h0.pdf", "h2.pdf"]
+
+    reopened = SimpleVectorStore(str(tmp_path))
+    assert reopened.n_deleted == 20
+    assert reopened.similarity_search(embeddings[25], k=10)[0] == documents
+
+    store.replace("h2", embeddings[:5], [{"doc_hash": "h2v2"}] * 5, [f"v2-{i}" for i in range(5)])
+    store.compact()
+    assert len(store) == 25 and store.n_deleted == 0
+    assert store.similarity_search(embeddings[3], k=1)[0] in (["h0-3"], ["v2-3"])
+    assert len(SimpleVectorStore(str(tmp_path))) == 25
+
+def test_small_uploads_are_merged_into_few_segments(tmp_path, make_store):
+    """Size-tiered merging bounds the segment count and keeps rows, order and results"""
+    from segment_store import MERGE_FACTOR, plan_merges
+    rng = np.random.default_rng(14)
+    embeddings = rng.standard_normal((400, 8))
+    texts = [f"note {i}" for i in range(400)]
+    store = make_store(compaction_threshold=1.0, index_type="hnsw")
+    for start in range(0, 400, 2):
+        store.add_documents(embeddings[start:start + 2], [{"doc_hash": f"h{start // 2}"}] * 2,
+                            texts[start:start + 2])
+    store.wait_for_index(timeout=60)
+    expected = store.similarity_search(embeddings[123], k=5)[0]
+    store.compact()
+
+    segments = store.segment_store.segments
+    assert not plan_merges(segments) and len(segments) < 3 * MERGE_FACTOR
+    assert store.index is not None  # merging alone keeps row ids and the ANN index
+    assert store.similarity_search(embeddings[123], k=5)[0] == expected == ["note 123"] + expected[1:]
+    assert store.lexical_search("123", k=1)[0] == ["note 123"]
+
+    store.delete("h0")
+    store.compact()
+    store.close()
+    reopened = SimpleVectorStore(str(tmp_path))
+    assert list(reopened.chunks.iter_from(0)) == texts[2:]
+
+def test_sharded_search_matches_single_process(tmp_path, make_store):
+    """Scatter-gather over worker processes returns the unsharded hits"""
+    rng = np.random.default_rng(5)
+    store = make_store(compaction_threshold=1.0)
+    for j in range(3):
+        store.add_documents(rng.standard_normal((100, 16)), [{"doc_hash": f"h{j}"}] * 100,
+                            [f"{j}-{i}" for i in range(100)])
+    store.delete("h1")
+    queries = rng.standard_normal((4, 16))
+
+    sharded = SimpleVectorStore(str(tmp_path), n_shards=3)
+    try:
+        for expected, result in zip(store.similarity_search_batch(queries, k=5),
+                                    sharded.similarity_search_batch(queries, k=5)):
+            assert result[0] == expected[0]
+            assert np.allclose(result[2], expected[2], atol=1e-5)
+    finally:
+        sharded.close()
+
+def test_collections_load_lazily_and_evict_cold_ones(tmp_path):
+    """Collections are independent and the least recently used is evicted over budget"""
+    from collection_manager import CollectionManager
+    manager = CollectionManager(str(tmp_path), memory_budget_mb=0)
+    rng = np.random.default_rng(6)
+    for name in ("a", "b"):
+        manager.get(name).add_documents(rng.standard_normal((10, 8)), [{"source": name}] * 10,
+                                        [name] * 10)
+
+    assert manager.list_collections() == ["a", "b"]
+    assert manager.loaded_collections() == ["b"]
+    assert manager.get("a").sources() == ["a"]
+    assert manager.loaded_collections() == ["a"]
+
+    manager.drop_collection("b")
+    assert manager.list_collections() == ["a"]
+
+    # Growth after opening counts too: the next get() evicts the grown collection
+    manager.memory_budget = 10 ** 5
+    manager.get("c")
+    assert manager.loaded_collections() == ["a", "c"]
+    manager.get("a").add_documents(rng.standard_normal((4000, 8)), [{"source": "a"}] * 4000,
+                                   ["a"] * 4000)
+    stale = manager.get("a")
+    manager.get("c")
+    assert manager.loaded_collections() == ["c"]
+
+    # An evicted instance still reads but cannot overwrite the reopened collection
+    assert stale.sources() == ["a"]
+    with pytest.raises(RuntimeError):
+        stale.add_documents(rng.standard_normal((1, 8)), [{"source": "x"}], ["x"])
+    assert manager.get("a").sources() == ["a"]
+
+    # A collection is reopened only once its evicted instance has finished writing
+    import threading
+    import time
+    old = manager.get("a")
+    manager.memory_budget = 0
+    old._write_lock.acquire()  # stands in for a running compaction
+    evicting = threading.Thread(target=manager.get, args=("c",))
+    evicting.start()
+    while "a" in manager.loaded_collections():
+        time.sleep(0.01)
+    reopened = []
+    reopening = threading.Thread(target=lambda: reopened.append(manager.get("a")))
+    reopening.start()
+    time.sleep(0.2)
+    assert reopening.is_alive() and not old.closed
+    old._write_lock.release()
+    evicting.join()
+    reopening.join()
+    assert old.closed and reopened[0] is not old and not reopened[0].closed
+
+def test_resource_registry_loads_each_resource_once():
+    """Concurrent sessions share one instance per key and memory is reported per resource"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from resource_registry import ResourceRegistry
+    registry = ResourceRegistry()
+    loads = []
+
+    def load():
+        loads.append(1)
+        time.sleep(0.05)
+        return EmbeddingGenerator()
+
+    with ThreadPoolExecutor(8) as pool:
+        models = list(pool.map(lambda _: registry.get("model", load), range(8)))
+    assert len(loads) == 1 and all(model is models[0] for model in models)
+
+    models[0].embed_query("hello")
+    assert registry.memory_usage()["model"] > 0
+
+def test_embedding_backend_comes_from_config(tmp_path):
+    """EMBEDDING_BACKEND selects sentence-transformers (and its encode pool) or hashed features"""
+    from config import Config
+    from resource_registry import get_embedding_model
+    for backend, use_torch in (("hashing", False), ("torch", True)):
+        config = Config(EMBEDDING_BACKEND=backend, EMBEDDING_CACHE_DIR=str(tmp_path / backend))
+        assert get_embedding_model(config).use_torch == use_torch
+
+def test_pickle_migration_and_reopen(tmp_path):
+    """A legacy vector_store.pkl is migrated; reopening serves lazily loaded metadata"""
+    import os
+    import pickle
+    rng = np.random.default_rng(12)
+    embeddings = rng.standard_normal((30, 8)).astype(np.float32)
+    metadatas = [{"source": f"{i % 3}.pdf", "page": i, "doc_hash": f"h{i % 3}"} for i in range(30)]
+    with open(tmp_path / "vector_store.pkl", "wb") as f:
+        pickle.dump({"embeddings": embeddings, "metadatas": metadatas,
+                     "chunks": [f"chunk {i}" for i in range(30)]}, f)
+
+    migrated = SimpleVectorStore(str(tmp_path))
+    assert os.path.exists(tmp_path / "vector_store.pkl.migrated")
+    expected = migrated.similarity_search(embeddings[4], k=3, filter={"source": "1.pdf"})
+
+    reopened = SimpleVectorStore(str(tmp_path))
+    assert not isinstance(reopened.metadatas.parts[0], list)  # read from disk per hit
+    assert reopened.sources() == ["0.pdf", "1.pdf", "2.pdf"]
+    documents, found, _ = reopened.similarity_search(embeddings[4], k=3, filter={"source": "1.pdf"})
+    assert documents == expected[0] and found[0]["page"] == 4
+
+    # Segments written before metadata columns were saved are encoded on open
+    for suffix in (".cols.npy", ".cols.json", ".meta.offsets.npy"):
+        os.remove(tmp_path / "segments" / f"seg_000000{suffix}")
+    legacy = SimpleVectorStore(str(tmp_path))
+    assert legacy.doc_hashes("2.pdf") == ["h2"] and legacy.metadatas[29]["page"] == 29
+    assert os.path.exists(tmp_path / "segments" / "seg_000000.cols.npy")
+
+def test_embedding_model_is_recorded_and_checked(tmp_path, make_store, capsys):
+    """Rows remember their embedding model; another model or dimension is refused"""
+    rng = np.random.default_rng(15)
+    store = make_store()
+    store.add_documents(rng.standard_normal((5, 8)), [{}] * 5, ["a"] * 5, model_id="st:mini")
+    reopened = SimpleVectorStore(str(tmp_path))
+    assert reopened.segment_store.model_ids == {"st:mini"}
+    reopened.check_model("st:mini", 8)
+    with pytest.raises(ValueError):
+        reopened.check_model("hashing:8", 8)
+    with pytest.raises(ValueError):
+        reopened.check_model("st:mini", 16)
+    with pytest.raises(ValueError):
+        reopened.add_documents(rng.standard_normal((2, 8)), [{}] * 2, ["b"] * 2, model_id="hashing:8")
+
+    # Rows stored without a model (e.g. migrated pickles) can only be warned about
+    legacy = make_store("legacy", rng.standard_normal((5, 8)))
+    capsys.readouterr()
+    legacy.check_model("st:mini", 8)
+    legacy.check_model("st:mini", 8)
+    assert capsys.readouterr().out.count("without their embedding model") == 1
+
+def test_wal_replay_and_versioned_snapshots(tmp_path, make_store, monkeypatch):
+    """Logged segments survive a crash before the manifest; old versions open read-only"""
+    import os
+    rng = np.random.default_rng(7)
+    store = make_store("", rng.standard_normal((20, 8)), [{"doc_hash": f"h{i % 2}"} for i in range(20)],
+                       ["a"] * 20, compaction_threshold=1.0)
+    first_version = store.segment_store.version
+    store.delete("h0")
+
+    # Crash after the log record, before the manifest write
+    segments = store.segment_store
+    segments._log_append(segments.write_segment(rng.standard_normal((10, 8)),
+                                                [{"doc_hash": "h2"}] * 10, ["b"] * 10))
+
+    reopened = SimpleVectorStore(str(tmp_path))
+    assert len(reopened) == 30
+    assert reopened.n_deleted == 10
+
+    old = SimpleVectorStore(str(tmp_path), version=first_version)
+    assert len(old) == 20 and old.tombstones is None
+    with pytest.raises(RuntimeError):
+        old.delete("h0")
+
+    # A failed disk write raises and leaves the store as it was
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(reopened.segment_store, "append", fail)
+    monkeypatch.setattr(reopened.segment_store, "write_tombstones", fail)
+    with pytest.raises(OSError):
+        reopened.add_documents(rng.standard_normal((5, 8)), [{"doc_hash": "h3"}] * 5, ["c"] * 5)
+    with pytest.raises(OSError):
+        reopened.delete("h2")
+    assert len(reopened) == 30 and reopened.n_deleted == 10
+
+    # A damaged store raises instead of starting empty
+    os.remove(os.path.join(str(tmp_path), "segments", "seg_000000.meta.jsonl"))
+    with pytest.raises(RuntimeError):
+        SimpleVectorStore(str(tmp_path))
+
+def test_dynamic_retrieval(make_store):
+    """Near-duplicate chunks are filtered by embedding similarity, low scores are cut"""
+    from dynamic_retriever import DynamicRetriever
+    query = np.array([1.0, 0.0, 0.0, 0.0])
+    embeddings = np.array([[1.0, 0.1, 0.0, 0.0],     # best hit
+                           [1.0, 0.1, 0.001, 0.0],   # near-duplicate of the best hit
+                           [0.9, 0.0, 0.5, 0.0],     # relevant, different direction
+                           [0.0, 0.0, 0.0, 1.0]])    # below the threshold
+    store = make_store("", embeddings, [{"doc_hash": f"h{i}"} for i in range(4)], ["a", "b", "c", "d"])
+
+    documents, _, scores = DynamicRetriever(store, similarity_threshold=0.5).retrieve_dynamic(query, "q")
+    assert documents == ["a", "c"] and scores[0] > scores[1]
+
+    # Hybrid mode keeps the threshold: "d" matches the keyword but not the meaning
+    hybrid = DynamicRetriever(store, similarity_threshold=0.5, hybrid=True)
+    assert hybrid.retrieve_dynamic(query, "d")[0] == ["a", "c"]
+
+def test_dynamic_retrieval_deepens_past_twenty(make_store):
+    """Every chunk above the threshold is returned, not just a fixed top-20"""
+    from dynamic_retriever import DynamicRetriever
+    rng = np.random.default_rng(11)
+    query = np.zeros(16)
+    query[0] = 1.0
+    embeddings = rng.standard_normal((200, 16))
+    embeddings[:60, 0] = 20.0  # 60 chunks close to the query
+    store = make_store("", embeddings, [{"doc_hash": f"h{i}"} for i in range(200)], ["text"] * 200)
+
+    retriever = DynamicRetriever(store, similarity_threshold=0.8, diversity_threshold=1.0)
+    documents, _, scores = retriever.retrieve_dynamic(query, "q")
+    cosines = embeddings @ query / np.linalg.norm(embeddings, axis=1)
+    assert len(documents) == np.sum(cosines >= 0.8) >= 60 and min(scores) >= 0.8
+    retriever.max_tokens = 10  # one chunk is 1 token
+    assert len(retriever.retrieve_dynamic(query, "q")[0]) == 10
+
+def test_token_counts_are_stored_at_ingestion(tmp_path, make_store):
+    """Chunks carry a token count column that budgets use without re-tokenizing"""
+    from token_counter import count_tokens
+    from dynamic_retriever import DynamicRetriever
+    texts = ["short chunk", "a somewhat longer chunk of text about solar panels", "tiny"]
+    embeddings = np.array([[1.0, 0.0, 0.0], [0.7, 0.7, 0.0], [0.6, 0.0, 0.8]])
+    make_store("", embeddings, [{"doc_hash": "a"}, {"doc_hash": "b"}, {"doc_hash": "c", "tokens": 3000}], texts)
+
+    reopened = SimpleVectorStore(str(tmp_path))
+    assert reopened.metadata_index.column("tokens").tolist() == count_tokens(texts[:2]) + [3000]
+    assert reopened.metadata_index.mask({"tokens": (0, 100)}).tolist() == [True, True, False]
+    retriever = DynamicRetriever(reopened, similarity_threshold=0.5, max_tokens=3001)
+    assert retriever.retrieve_dynamic(np.array([1.0, 0.0, 0.0]), "q")[0] == texts[:2]
+
+def test_estimated_token_counts_are_recounted_with_tiktoken(tmp_path, make_store, monkeypatch):
+    """Counts estimated without tiktoken are marked as such and recounted once it loads"""
+    import json
+    import token_counter
+
+    class WordEncoder:
+        def encode_ordinary_batch(self, texts):
+            return [text.split() for text in texts]
+
+    texts = ["one two three four five six seven eight", "nine ten"]
+    monkeypatch.setattr(token_counter, "_ENCODER", False)
+    make_store("", np.eye(2), chunks=texts)
+    info_path = tmp_path / "segments" / "seg_000000.cols.json"
+    assert json.loads(info_path.read_text())["tokenizer"] == token_counter.FALLBACK_NAME
+
+    monkeypatch.setattr(token_counter, "_ENCODER", WordEncoder())
+    assert SimpleVectorStore(str(tmp_path)).metadata_index.column("tokens").tolist() == [8, 2]
+    assert json.loads(info_path.read_text())["tokenizer"] == token_counter.ENCODING_NAME
+
+def test_context_filtering_budgets_with_stored_token_counts():
+    """The context budget uses each chunk's stored count, not its character length"""
+    from context_filtering import ContextFiltering
+    metadatas = [{"source_file": "a.pdf", "page_number": 1, "tokens": 3000},
+                 {"source_file": "a.pdf", "page_number": 2, "tokens": 1500},
+                 {"source_file": "b.pdf", "page_number": 1, "tokens": 900}]
+    context, kept = ContextFiltering(max_context_tokens=4000).filter_context(["x", "y", "z"], metadatas, "q")
+    assert kept == metadatas[:1] and context.endswith("x")
+
+    from context_manager import ContextManager
+    metadatas = [dict(meta, source=meta["source_file"], page=meta["page_number"]) for meta in metadatas]
+    _, kept = ContextManager(max_context_tokens=4000).filter_context(["x", "y", "z"], metadatas, [0.9] * 3, "q")
+    assert [meta["tokens"] for meta in kept] == [3000, 900]
+
+def test_reranker_reorders_within_budget_and_caches_pairs():
+    """Cross-encoder order wins, pair scores are cached, and the budget bounds model calls"""
+    from reranker import CrossEncoderReranker
+
+    class KeywordModel:
+        """Stands in for a CrossEncoder: scores pairs by occurrences of 'solar'"""
+        calls = 0
+        def predict(self, pairs, batch_size=32, show_progress_bar=False):
+            self.calls += 1
+            return [doc.count("solar") for _, doc in pairs]
+
+    model = KeywordModel()
+    reranker = CrossEncoderReranker(model=model, batch_size=2)
+    documents = ["wind", "solar", "solar solar", "hydro"]
+    metadatas = [{"doc_hash": "d", "chunk_id": i} for i in range(4)]
+    scores = [0.9, 0.8, 0.7, 0.6]
+
+    reranked, _, reranked_scores = reranker.rerank("solar power?", documents, metadatas, scores)
+    assert reranked[:2] == ["solar solar", "solar"] and reranked_scores[:2] == [0.7, 0.8]
+    assert reranker.rerank("Solar  power?", documents, metadatas, scores)[0] == reranked
+    assert model.calls == 2 and reranker.hit_rate == 0.5
+
+    reranker.time_budget_ms = 0  # nothing new gets scored: first-stage order is kept
+    assert reranker.rerank("hydro", documents, metadatas, scores)[0] == documents and model.calls == 2
+
+    # Same doc_hash and chunk_id, different text (re-chunked upload): scored afresh
+    reranker.time_budget_ms = 300.0
+    reranker.rerank("solar power?", ["solar tides", "wind"], metadatas[:2], scores[:2])
+    assert model.calls == 3
 
 if __name__ == "__main__":
     print("Running RAG pipeline tests...")
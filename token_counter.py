@@ -0,0 +1,42 @@
+# src/token_counter.py - TOKEN COUNTS FOR CONTEXT BUDGETS
+from typing import Dict, List
+
+# Tokenizer of the OpenAI chat models the context is sized for
+ENCODING_NAME = "cl100k_base"
+# Recorded with counts estimated without tiktoken, so they can be recounted later
+FALLBACK_NAME = "chars/4"
+
+# Loaded once per process; False once loading has failed
+_ENCODER = None
+
+
+def _get_encoder():
+    global _ENCODER
+    if _ENCODER is None:
+        try:
+            import tiktoken
+            _ENCODER = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception as e:
+            # tiktoken missing, or its BPE file cannot be downloaded
+            print(f"⚠️ tiktoken unavailable ({e}), estimating tokens as characters / 4")
+            _ENCODER = False
+    return _ENCODER
+
+
+def tokenizer_name() -> str:
+    """Name of what count_tokens uses: ENCODING_NAME, or FALLBACK_NAME without tiktoken"""
+    return ENCODING_NAME if _get_encoder() else FALLBACK_NAME
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """Token count of each text (run once per chunk, at ingestion)"""
+    encoder = _get_encoder()
+    if not encoder:
+        return [len(text) // 4 for text in texts]
+    return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts)]
+
+
+def chunk_tokens(document: str, metadata: Dict) -> int:
+    """Stored token count of a retrieved chunk (estimated for chunks stored without one)"""
+    tokens = metadata.get("tokens")
+    return tokens if tokens is not None else len(document) // 4
@@ -0,0 +1,209 @@
+# src/vector_index.py - ANN INDEX BACKENDS FOR THE VECTOR STORE
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    faiss = None
+    FAISS_AVAILABLE = False
+
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+
+# FAISS warns below ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+# New rows a ready index takes inline; a larger backlog is added in the background
+INDEX_SYNC_ROWS = 4096
+
+
+def top_k(similarities: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise top-k of a (n_queries, n_rows) score matrix, best first.
+
+    Uses argpartition so only the k winners get sorted, O(n + k log k) per row.
+    """
+    n_rows = similarities.shape[1]
+    k = min(k, n_rows)
+    if k < n_rows:
+        ids = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        ids = np.broadcast_to(np.arange(n_rows), similarities.shape)
+    scores = np.take_along_axis(similarities, ids, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def merge_top_k(scores: List[np.ndarray], ids: List[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge per-block (scores, ids) top-k results into a global top-k"""
+    merged_scores, order = top_k(np.hstack(scores), k)
+    return merged_scores, np.take_along_axis(np.hstack(ids), order, axis=1)
+
+
+class FaissIndex:
+    """Base wrapper around a FAISS inner-product index.
+
+    Row ids handed out by FAISS are the insertion order, which matches the
+    row numbers of SimpleVectorStore as long as vectors are added in order.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.index = self._build()
+
+    def _build(self):
+        raise NotImplementedError
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size: the full-precision copy of every vector"""
+        return self.ntotal * self.dimension * 4
+
+    @property
+    def persistable(self) -> bool:
+        """Whether save() captures every vector added so far"""
+        return True
+
+    def save(self, path: str):
+        faiss.write_index(self.index, path)
+
+    def load(self, path: str):
+        """Replace the index with one written by save()"""
+        self.index = faiss.read_index(path)
+
+    def add(self, vectors: np.ndarray):
+        """Add L2-normalized float32 vectors"""
+        if len(vectors) == 0:
+            return
+        self.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (scores, ids) of shape (n_queries, k); missing hits have id -1"""
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.dimension)
+        k = min(k, self.ntotal)
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+        return self.index.search(queries, k)
+
+    def reset(self):
+        """Drop all vectors"""
+        self.index = self._build()
+
+
+class HNSWIndex(FaissIndex):
+    """Graph-based index: sub-linear queries, no training, higher memory"""
+
+    def __init__(self, dimension: int, m: int = 32, ef_construction: int = 200,
+                 ef_search: int = 64):
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        super().__init__(dimension)
+
+    @property
+    def nbytes(self) -> int:
+        # Vectors plus roughly 2*m neighbour ids per node on the base layer
+        return self.ntotal * (self.dimension * 4 + self.m * 2 * 4)
+
+    def _build(self):
+        index = faiss.IndexHNSWFlat(self.dimension, self.m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = self.ef_construction
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def load(self, path: str):
+        super().load(path)
+        self.index.hnsw.efSearch = self.ef_search
+
+
+class IVFIndex(FaissIndex):
+    """Inverted-file index; trains itself once enough vectors have arrived.
+
+    Until then vectors are kept in a pending buffer and searched exactly, so
+    small stores behave like the flat backend.
+    """
+
+    def __init__(self, dimension: int, nlist: int = 256, nprobe: int = 16):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._pending = []
+        super().__init__(dimension)
+
+    def _build(self):
+        self.quantizer = faiss.IndexFlatIP(self.dimension)  # keep alive for the IVF index
+        index = faiss.IndexIVFFlat(self.quantizer, self.dimension, self.nlist,
+                                   faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = self.nprobe
+        return index
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal + sum(len(v) for v in self._pending)
+
+    @property
+    def persistable(self) -> bool:
+        # Untrained, every vector is still in the pending buffer
+        return self.index.is_trained
+
+    def load(self, path: str):
+        super().load(path)
+        self.index.nprobe = self.nprobe
+        self._pending = []
+
+    def add(self, vectors: np.ndarray):
+        if len(vectors) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index.is_trained:
+            self.index.add(vectors)
+            return
+
+        self._pending.append(vectors)
+        pending_rows = sum(len(v) for v in self._pending)
+        if pending_rows >= self.nlist * MIN_POINTS_PER_CENTROID:
+            training = np.vstack(self._pending)
+            self.index.train(training)
+            self.index.add(training)
+            self._pending = []
+            print(f"✓ Trained IVF index ({self.nlist} lists) on {len(training)} vectors")
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.index.is_trained:
+            return super().search(queries, k)
+
+        # Not trained yet: exact inner product over the pending vectors
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.dimension)
+        vectors = np.vstack(self._pending) if self._pending else np.empty((0, self.dimension), np.float32)
+        scores, ids = top_k(queries @ vectors.T, k)
+        return scores, ids.astype(np.int64)
+
+    def reset(self):
+        self._pending = []
+        super().reset()
+
+
+def create_index(index_type: str, dimension: int, params: Optional[Dict] = None) -> Optional[FaissIndex]:
+    """Build an index backend.
+
+    Returns None for "flat", meaning exact inner-product search directly over
+    the store's own embedding matrix (no second copy of the vectors). Falls back
+    to None with a warning when FAISS is not installed.
+    """
+    params = params or {}
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    if index_type == "flat":
+        return None
+
+    if not FAISS_AVAILABLE:
+        print(f"⚠️ faiss not available, using exact search instead of '{index_type}'")
+        return None
+
+    if index_type == "hnsw":
+        return HNSWIndex(dimension, **params)
+    return IVFIndex(dimension, **params)
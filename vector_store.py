@@ -1,96 +1,944 @@
 # src/vector_store.py - SIMPLE FIXED VERSION
 import os
+import time
 import pickle
+import itertools
+import threading
 import numpy as np
-from typing import List, Dict, Tuple
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional
+
+from vector_index import create_index, top_k, merge_top_k, INDEX_SYNC_ROWS
+from segment_store import SegmentStore, plan_merges
+from embedding_buffer import EmbeddingBuffer
+from metadata_index import MetadataIndex, MISSING
+from token_counter import count_tokens, tokenizer_name, ENCODING_NAME, FALLBACK_NAME
+from quantization import QuantizedIndex, TRAIN_ROWS, SCAN_ROWS
+from sharded_search import ShardedSearcher
+from chunk_store import ChunkStore
+from sparse_index import SparseIndex
 
 class SimpleVectorStore:
-    def __init__(self, persist_dir: str = "./vector_db"):
+    def __init__(self, persist_dir: str = "./vector_db", index_type: str = "flat",
+                 index_params: Optional[Dict] = None, quantization: str = "none",
+                 rerank_factor: int = 4, pq_m: int = 48, compaction_threshold: float = 0.2,
+                 n_shards: int = 1, version: Optional[int] = None, dtype: Optional[str] = None):
         self.persist_dir = persist_dir
-        os.makedirs(persist_dir, exist_ok=True)
+        # Opening a specific snapshot version is read-only
+        self.read_only = version is not None
+        self.closed = False
+        if not self.read_only:
+            os.makedirs(persist_dir, exist_ok=True)
+        # float16 halves memory and disk reads; rows are upcast in blocks for scoring
+        self.segment_store = SegmentStore(persist_dir, version, dtype)
+        self.dtype = self.segment_store.dtype
+        
+        # Rows loaded at startup stay memory-mapped per segment; rows added by
+        # this process go into a growable buffer and are appended as new segments
+        self.segments = []
+        self.buffer = None
+        self.metadatas = ChunkStore()  # dicts stay on disk, parsed per hit
+        self.chunks = ChunkStore()  # texts stay on disk, fetched per hit
+        self.metadata_index = MetadataIndex()  # filter columns, loaded from each segment's .cols.npy
+        
+        # Deleted rows stay in place, masked by a tombstone bitmap, until
+        # compaction rewrites the affected segments
+        self.tombstones = None
+        self.n_deleted = 0
+        self.compaction_threshold = compaction_threshold
+        self._warned_models = set()
+        
+        # _write_lock serializes writers (including a background compaction);
+        # _lock guards the in-memory state that searches read
+        self._write_lock = threading.Lock()
+        self._lock = threading.RLock()
+        
+        # Derived indexes (ANN, quantized codes) are loaded or built by
+        # background threads, keyed by attribute name; searches stay exact
+        # until a thread hands its index over. Compaction bumps the
+        # generation so a build over the old row numbers is discarded.
+        self._builds: Dict[str, threading.Thread] = {}
+        self._failed_builds = set()
+        self._index_generation = 0
+        
+        # ANN backend, created once the embedding dimension is known
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.index = None
+        self._index_saved_rows = 0
         
-        self.embeddings = None
-        self.metadatas = []
-        self.chunks = []
+        # Optional compressed first pass (int8 / PQ) with exact float rerank
+        if quantization != "none" and index_type != "flat":
+            raise ValueError("quantization is only supported with the flat index")
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.pq_m = pq_m
+        self.quantized = None
+        
+        # Lexical BM25 inverted index over the chunk texts, built in the
+        # background at open from the term counts persisted with each segment
+        # and then extended by every add_documents
+        self.sparse = None
+        self._hybrid_pool = None
+        
+        # Exact scans can be split across worker processes
+        self.sharded = ShardedSearcher(self.segment_store, n_shards) if n_shards > 1 else None
         
         # Try to load existing data
         self.load_from_disk()
     
+    @classmethod
+    def from_config(cls, config):
+        """Create a store using the index settings from Config"""
+        return cls(config.PERSIST_DIRECTORY, **cls.config_kwargs(config))
+    
+    @staticmethod
+    def config_kwargs(config) -> Dict:
+        """Constructor arguments (other than persist_dir) taken from Config"""
+        index_params = {}
+        if config.INDEX_TYPE == "hnsw":
+            index_params = {"m": config.HNSW_M, "ef_search": config.HNSW_EF_SEARCH}
+        elif config.INDEX_TYPE == "ivf":
+            index_params = {"nlist": config.IVF_NLIST, "nprobe": config.IVF_NPROBE}
+        return dict(index_type=config.INDEX_TYPE, index_params=index_params,
+                    quantization=config.QUANTIZATION, rerank_factor=config.RERANK_FACTOR,
+                    pq_m=config.PQ_M, compaction_threshold=config.COMPACTION_THRESHOLD,
+                    n_shards=config.SEARCH_SHARDS, dtype=config.EMBEDDING_DTYPE)
+    
     def create_collection(self, collection_name: str = "document_qa"):
         """Initialize the vector store"""
         print("✓ Simple vector store ready")
         return True
     
-    def add_documents(self, embeddings: np.ndarray, metadatas: List[Dict], chunks: List[str]):
-        """Add documents to vector store"""
+    def __len__(self):
+        return len(self.chunks)
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate bytes per component (mapped segments counted as if resident)"""
+        embeddings = sum(segment.nbytes for segment in self.segments)
+        if self.buffer is not None:
+            embeddings += self.buffer.nbytes
+        
+        return {
+            "embeddings": int(embeddings),
+            "chunks": self.chunks.nbytes,
+            "metadata": self.metadatas.nbytes + self.metadata_index.nbytes,
+            "index": self.index.nbytes if self.index is not None else 0,
+            "quantized": self.quantized.nbytes if self.quantized is not None else 0,
+            "sparse": self.sparse.nbytes if self.sparse is not None else 0,
+        }
+    
+    @property
+    def dimension(self) -> Optional[int]:
+        for _, block in self._blocks():
+            return block.shape[1]
+        return None
+    
+    def _blocks(self):
+        """Yield (row_offset, matrix) for each block of stored rows, in row order"""
+        blocks = list(self.segments)
+        if self.buffer is not None and len(self.buffer) > 0:
+            blocks.append(self.buffer.view)
+        offset = 0
+        for block in blocks:
+            yield offset, block
+            offset += len(block)
+    
+    def _scan_blocks(self):
+        """Like _blocks, but always float32: float16 rows are upcast SCAN_ROWS at a time"""
+        for offset, block in self._blocks():
+            if block.dtype == np.float32:
+                yield offset, block
+            else:
+                for start in range(0, len(block), SCAN_ROWS):
+                    yield offset + start, block[start:start + SCAN_ROWS].astype(np.float32)
+    
+    def add_documents(self, embeddings: np.ndarray, metadatas: List[Dict], chunks: List[str],
+                      model_id: Optional[str] = None):
+        """Add documents to vector store; `model_id` (EmbeddingGenerator.model_id) is recorded with them"""
         if len(embeddings) == 0:
             print("⚠️ No embeddings to add")
             return
+        tokens = self._token_counts(metadatas, chunks)
         
-        if self.embeddings is None:
-            self.embeddings = embeddings.astype(np.float32)
-        else:
-            self.embeddings = np.vstack([self.embeddings, embeddings.astype(np.float32)])
+        with self._write_lock:
+            # Checked under the lock: close() may have run since the caller got the store
+            self._check_writable()
+            if model_id is not None:
+                self.check_model(model_id, embeddings.shape[1])
+            # Rows are staged past the buffer's visible end, so searches only
+            # see them once text and metadata are in place too
+            if self.buffer is None:
+                self.buffer = EmbeddingBuffer(embeddings.shape[1], dtype=self.dtype)
+            if self.dtype == np.float32:
+                new_rows = self._normalize(self.buffer.stage(embeddings), inplace=True)
+            else:
+                # Normalize at full precision before rounding to float16
+                new_rows = self.buffer.stage(self._normalize(embeddings))
+            
+            # Save to disk first; if that fails the staged rows are never committed
+            segment = self.segment_store.append(new_rows, metadatas, chunks, tokens, model_id)
+            
+            with self._lock:
+                self.buffer.commit(len(new_rows))
+                self.metadatas.add_part(self.segment_store.open_metadatas(segment))
+                self.chunks.add_part(self.segment_store.open_chunks(segment))
+                self.metadata_index.add(metadatas, tokens)
+                if self.sparse is not None:
+                    self._add_sparse_rows(self.sparse)
+                if self.tombstones is not None:
+                    self.tombstones = np.concatenate([self.tombstones, np.zeros(len(chunks), dtype=bool)])
+        print(f"✓ Added {len(chunks)} documents to store")
+        if plan_merges(self.segment_store.segments):
+            self.compact(background=True)
+    
+    def delete(self, doc_hash: str) -> int:
+        """Remove every chunk of a document; returns the number of chunks removed"""
+        with self._write_lock:
+            self._check_writable()
+            with self._lock:
+                mask = self.metadata_index.mask({"doc_hash": doc_hash})
+                if self.tombstones is not None:
+                    mask &= ~self.tombstones
+                removed = int(mask.sum())
+                if removed == 0:
+                    return 0
+                tombstones = mask if self.tombstones is None else self.tombstones | mask
+            
+            # Persist first, so a failed write leaves the store unchanged
+            self.segment_store.write_tombstones(tombstones)
+            with self._lock:
+                self.tombstones = tombstones
+                self.n_deleted += removed
         
-        self.metadatas.extend(metadatas)
-        self.chunks.extend(chunks)
+        print(f"✓ Deleted {removed} chunks of document {doc_hash}")
+        if self.n_deleted >= self.compaction_threshold * len(self):
+            self.compact(background=True)
+        return removed
+    
+    def sources(self) -> List[str]:
+        """Source files that still have chunks in the store"""
+        return sorted(self.metadata_index.values("source", self._live_mask()))
+    
+    def doc_hashes(self, source: str) -> List[str]:
+        """Hashes of the stored documents that came from a source file"""
+        mask = self.metadata_index.mask({"source": source}) & self._live_mask()
+        return self.metadata_index.values("doc_hash", mask)
+    
+    def check_model(self, model_id: str, dimension: int):
+        """Refuse vectors from another embedding space than the stored rows.
         
-        # Save to disk
-        self._save_to_disk()
-        print(f"✓ Added {len(chunks)} documents to store")
+        Call before adding rows or searching with a query embedding. Rows
+        stored before models were recorded (older stores, migrated pickles,
+        possibly TF-IDF vectors) cannot be checked, so they only warn once.
+        """
+        if self.dimension is not None and dimension != self.dimension:
+            raise ValueError(f"{self.persist_dir} holds {self.dimension}-dim embeddings, "
+                             f"got {dimension}-dim ones from {model_id}")
+        with self._lock:
+            stored = self.segment_store.model_ids
+        known = stored - {None}
+        if known and known != {model_id}:
+            raise ValueError(f"{self.persist_dir} was embedded with {', '.join(sorted(known))}, "
+                             f"not {model_id}; re-upload its documents to search it with this model")
+        if None in stored and model_id not in self._warned_models:
+            self._warned_models.add(model_id)
+            print(f"⚠️ {self.persist_dir} has rows stored without their embedding model; "
+                  f"they may not be comparable with {model_id} embeddings")
+    
+    def _check_writable(self):
+        if self.closed:
+            raise RuntimeError(f"Vector store {self.persist_dir} is closed; reopen it to write")
+        if self.read_only:
+            raise RuntimeError(f"Vector store version {self.segment_store.version} is opened read-only")
+    
+    def _live_mask(self) -> np.ndarray:
+        if self.tombstones is None:
+            return np.ones(len(self), dtype=bool)
+        return ~self.tombstones
+    
+    def replace(self, doc_hash: str, embeddings: np.ndarray, metadatas: List[Dict], chunks: List[str]):
+        """Swap a document's chunks for a new version"""
+        self.delete(doc_hash)
+        self.add_documents(embeddings, metadatas, chunks)
+    
+    def compact(self, background: bool = False):
+        """Merge runs of small segments, rewrite the ones that contain deleted rows and drop the tombstones.
+        
+        Searches keep running on the old state while the new segment files are
+        written; only the final swap blocks them. Writers wait for compaction.
+        Merging alone keeps row ids, and with them the derived indexes.
+        """
+        if background:
+            thread = threading.Thread(target=self.compact, daemon=True)
+            thread.start()
+            return thread
+        
+        with self._write_lock:
+            if self.closed:
+                return
+            self._check_writable()
+            segments = self.segment_store.segments
+            merges = dict(plan_merges(segments))
+            if self.n_deleted == 0 and not merges:
+                return
+            if self.segment_store.total_rows != len(self):
+                print("⚠️ Store is not fully persisted, skipping compaction")
+                return
+            
+            tombstones = self.tombstones if self.tombstones is not None else np.zeros(len(self), dtype=bool)
+            dead_rows = int(tombstones.sum())
+            new_segments = []
+            i, start = 0, 0
+            while i < len(segments):
+                # Each run of merged segments, or single segment, becomes at most one new segment
+                group = segments[i:merges.get(i, i + 1)]
+                end = start + sum(segment["rows"] for segment in group)
+                dead = tombstones[start:end]
+                if len(group) == 1 and not dead.any():
+                    new_segments.append(group[0])
+                elif not dead.all():
+                    new_segments.append(self._rewrite_segments(group, start, dead))
+                i, start = i + len(group), end
+            
+            metadatas = ChunkStore()
+            metadata_index = MetadataIndex()
+            for seg in new_segments:
+                metadatas.add_part(self.segment_store.open_metadatas(seg))
+                self._add_columns(seg, metadata_index)
+            
+            with self._lock:
+                self.segment_store.commit_segments(new_segments)
+                self.segments = [self.segment_store.open_embeddings(seg) for seg in new_segments]
+                self.buffer = None
+                self.chunks = ChunkStore()
+                for seg in new_segments:
+                    self.chunks.add_part(self.segment_store.open_chunks(seg))
+                self.metadatas = metadatas
+                self.metadata_index = metadata_index
+                self.tombstones = None
+                self.n_deleted = 0
+                if dead_rows:
+                    # Row ids changed: derived indexes are rebuilt, the ANN and
+                    # quantized ones lazily, BM25 right away in the background
+                    self.index = None
+                    self._index_generation += 1
+                    self.quantized = None
+                    self._start_build("sparse", self._build_sparse, SparseIndex())
+                else:
+                    # Same rows under new segment names: save the index again on close
+                    self._index_saved_rows = 0
+        print(f"✓ Compacted store to {len(metadatas)} chunks in {len(new_segments)} segments"
+              f" ({dead_rows} deleted rows dropped)")
+    
+    def _rewrite_segments(self, group: List[Dict], start: int, dead: np.ndarray) -> Dict:
+        """Write the live rows of adjacent segments, the first at row `start`, as one new segment"""
+        live = np.flatnonzero(~dead)
+        embeddings, metadatas, chunks, tokenizers = [], [], [], set()
+        model_ids = {segment.get("model_id") for segment in group}
+        offset = 0
+        for segment in group:
+            rows = live[(live >= offset) & (live < offset + segment["rows"])] - offset
+            offset += segment["rows"]
+            segment_metadatas = self.segment_store.read_metadatas(segment)
+            segment_chunks = self.segment_store.read_chunks(segment)
+            embeddings.append(self.segment_store.open_embeddings(segment)[rows])
+            metadatas += [segment_metadatas[i] for i in rows]
+            chunks += [segment_chunks[i] for i in rows]
+            columns = self.segment_store.read_columns(segment)
+            tokenizers.add(columns[1].get("tokenizer", FALLBACK_NAME) if columns else FALLBACK_NAME)
+        return self.segment_store.write_segment(
+            np.concatenate(embeddings), metadatas, chunks,
+            tokens=self.metadata_index.column("tokens")[start:start + len(dead)][live],
+            # Mixed tokenizers are marked as estimates, so the counts are redone later
+            tokenizer=tokenizers.pop() if len(tokenizers) == 1 else FALLBACK_NAME,
+            model_id=model_ids.pop() if len(model_ids) == 1 else None
+        )
+    
+    def reserve(self, n_rows: int, dimension: Optional[int] = None):
+        """Preallocate room for n_rows more rows when the final count is known"""
+        if self.buffer is None:
+            dimension = self.dimension or dimension
+            if dimension is None:
+                raise ValueError("dimension is required to reserve rows in an empty store")
+            self.buffer = EmbeddingBuffer(dimension, dtype=self.dtype)
+        self.buffer.reserve(len(self.buffer) + n_rows)
+    
+    def similarity_search(self, query_embedding: np.ndarray, k: int = 10,
+                          filter: Optional[Dict] = None, return_embeddings: bool = False):
+        """Search for similar documents, optionally restricted by a metadata filter.
+        
+        With return_embeddings=True a fourth element holds the hits' stored
+        (normalized) rows, one per document.
+        """
+        if not return_embeddings:
+            return self.similarity_search_batch(query_embedding.reshape(1, -1), k, filter)[0]
+        with self._lock:
+            if len(self) == 0:
+                return [], [], [], np.empty((0, self.dimension or 0), np.float32)
+            top_scores, top_ids = self._dense_top_k(query_embedding.reshape(1, -1), k, filter)
+            return self._gather_with_rows(top_ids[0], top_scores[0])
+    
+    def similarity_search_batch(self, query_matrix: np.ndarray, k: int = 10,
+                                filter: Optional[Dict] = None) -> List[Tuple[List[str], List[Dict], List[float]]]:
+        """Search many queries with one matrix multiply per block.
+        
+        `filter` is a MetadataIndex filter dict (e.g. {"source": "a.pdf",
+        "page": (1, 5)}) or a boolean row mask; only matching rows are scored.
+        Returns one (documents, metadatas, scores) tuple per query row.
+        """
+        query_matrix = np.atleast_2d(query_matrix)
+        with self._lock:
+            if len(self) == 0:
+                return [([], [], []) for _ in range(len(query_matrix))]
+            top_scores, top_ids = self._dense_top_k(query_matrix, k, filter)
+            return [self._gather(ids, scores) for ids, scores in zip(top_ids, top_scores)]
+    
+    def _dense_top_k(self, query_matrix: np.ndarray, k: int, filter) -> Tuple[np.ndarray, np.ndarray]:
+        """(scores, row ids) of the vector search; the caller holds _lock"""
+        # Rows are stored L2-normalized, so inner product == cosine similarity
+        queries = self._normalize(query_matrix)
+        k = min(k, len(self))
+        
+        row_mask = filter if isinstance(filter, np.ndarray) else self.metadata_index.mask(filter)
+        if row_mask is not None and self.tombstones is not None:
+            row_mask = row_mask & ~self.tombstones
+        index = self._sync_index()
+        if row_mask is not None:
+            return self._filtered_search(queries, k, np.flatnonzero(row_mask))
+        elif index is not None:
+            return self._search_live(index.search, queries, k)
+        elif self.quantization != "none" and self._sync_quantized() is not None:
+            return self._search_live(self._quantized_search, queries, k)
+        return self._exact_search(queries, k)
+    
+    def lexical_search(self, query: str, k: int = 10, filter: Optional[Dict] = None):
+        """Keyword (BM25) search over the chunk texts via the inverted index"""
+        return self.lexical_search_batch([query], k, filter)[0]
+    
+    def lexical_search_batch(self, queries: List[str], k: int = 10,
+                             filter: Optional[Dict] = None) -> List[Tuple[List[str], List[Dict], List[float]]]:
+        """Keyword search for many query texts; only chunks sharing a term are returned"""
+        self._wait_for_sparse()
+        with self._lock:
+            if len(self) == 0:
+                return [([], [], []) for _ in queries]
+            top_scores, top_ids = self._lexical_top_k(self._ready_sparse(), queries, k, filter)
+            return [self._gather(ids, scores) for ids, scores in zip(top_ids, top_scores)]
+    
+    def _lexical_top_k(self, sparse: SparseIndex, queries: List[str], k: int,
+                       filter) -> Tuple[np.ndarray, np.ndarray]:
+        """(scores, row ids) of the BM25 search; the caller holds _lock"""
+        row_mask = filter if isinstance(filter, np.ndarray) else self.metadata_index.mask(filter)
+        if self.tombstones is not None:
+            row_mask = ~self.tombstones if row_mask is None else row_mask & ~self.tombstones
+        return sparse.search(queries, min(k, len(self)), row_mask)
+    
+    def hybrid_search(self, query: str, query_embedding: np.ndarray, k: int = 10,
+                      filter: Optional[Dict] = None, fetch_k: int = 50, rrf_k: int = 60,
+                      return_embeddings: bool = False):
+        """Fuse BM25 and vector results with reciprocal rank fusion.
+        
+        Both searches fetch `fetch_k` candidates (the BM25 side in a worker
+        thread, alongside the dense scan); each hit scores sum(1 / (rrf_k + rank))
+        over the lists it appears in. Hits come back in fused order, with each
+        hit's cosine similarity as its score so thresholds keep their meaning.
+        return_embeddings=True adds the hits' rows, as in similarity_search.
+        """
+        empty = ([], [], [], np.empty((0, self.dimension or 0), np.float32)) if return_embeddings else ([], [], [])
+        self._wait_for_sparse()
+        with self._lock:
+            if len(self) == 0:
+                return empty
+            if self._hybrid_pool is None:
+                self._hybrid_pool = ThreadPoolExecutor(max_workers=1)
+            lexical = self._hybrid_pool.submit(self._lexical_top_k, self._ready_sparse(), [query], fetch_k, filter)
+            _, dense_ids = self._dense_top_k(query_embedding.reshape(1, -1), fetch_k, filter)
+            _, lexical_ids = lexical.result()
+            
+            fused = {}
+            for ids in (dense_ids[0], lexical_ids[0]):
+                for rank, i in enumerate(int(i) for i in ids if i >= 0):
+                    fused[i] = fused.get(i, 0.0) + 1.0 / (rrf_k + rank + 1)
+            ids = np.array(sorted(fused, key=fused.get, reverse=True)[:k], dtype=np.int64)
+            if len(ids) == 0:
+                return empty
+            rows = self._take_rows(ids)
+            result = self._gather(ids, rows @ self._normalize(query_embedding.reshape(1, -1))[0])
+            return result + (rows,) if return_embeddings else result
+    
+    def _exact_search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact inner-product top-k: partial selection per block, then merge"""
+        if self.sharded is not None and self.segment_store.total_rows == len(self):
+            # Every row is on disk, so worker processes can map the segments
+            scores, ids = self.sharded.search(queries, k, self.tombstones)
+            ids[np.isneginf(scores)] = -1
+            return scores, ids
+        
+        block_scores, block_ids = [], []
+        for offset, block in self._scan_blocks():
+            similarities = queries @ block.T
+            if self.tombstones is not None:
+                similarities[:, self.tombstones[offset:offset + len(block)]] = -np.inf
+            scores, ids = top_k(similarities, k)
+            block_scores.append(scores)
+            block_ids.append(ids + offset)
+        scores, ids = merge_top_k(block_scores, block_ids, k)
+        ids[np.isneginf(scores)] = -1
+        return scores, ids
+    
+    def close(self):
+        """Stop the shard worker processes and the hybrid search thread, if any.
+        
+        A closed store still answers searches but rejects writes, so a stale
+        reference to an evicted collection cannot overwrite the manifest that
+        a newer instance of the same collection has written since. Waits for
+        running writers, including a background compaction; one that was
+        queued but not started is dropped (its tombstones are on disk).
+        """
+        with self._write_lock:
+            with self._lock:
+                if self.index is not None and self.index.ntotal > self._index_saved_rows:
+                    self._save_index(self.index)
+            self.closed = True
+            self.read_only = True
+            self.segment_store.read_only = True
+        if self.sharded is not None:
+            self.sharded.close()
+        if self._hybrid_pool is not None:
+            self._hybrid_pool.shutdown()
+            self._hybrid_pool = None
     
-    def similarity_search(self, query_embedding: np.ndarray, k: int = 10):
-        """Search for similar documents"""
-        if self.embeddings is None or len(self.embeddings) == 0:
-            return [], [], []
+    def _search_live(self, search, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Run an approximate search, over-fetching until each query has k live hits"""
+        if self.tombstones is None:
+            return search(queries, k)
         
-        # Calculate cosine similarities
-        from sklearn.metrics.pairwise import cosine_similarity
+        fetch = min(2 * k, len(self))
+        while True:
+            scores, ids = search(queries, fetch)
+            live = (ids >= 0) & ~self.tombstones[np.maximum(ids, 0)]
+            if fetch >= len(self) or (live.sum(axis=1) >= k).all():
+                break
+            fetch = min(2 * fetch, len(self))
         
-        # Ensure query is 2D
-        if query_embedding.ndim == 1:
-            query_embedding = query_embedding.reshape(1, -1)
+        scores, order = top_k(np.where(live, scores, -np.inf), k)
+        ids = np.take_along_axis(ids, order, axis=1)
+        ids[np.isneginf(scores)] = -1
+        return scores, ids
+    
+    def _quantized_search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Scan compressed codes for k * rerank_factor candidates, rerank exactly"""
+        _, candidates = self.quantized.search(queries, k * self.rerank_factor)
+        
+        # Exact scores from the full-precision rows (memory-mapped from disk)
+        scores = np.empty(candidates.shape, dtype=np.float32)
+        for i, ids in enumerate(candidates):
+            scores[i] = self._take_rows(ids) @ queries[i]
+        top_scores, order = top_k(scores, k)
+        return top_scores, np.take_along_axis(candidates, order, axis=1)
+    
+    def _take_rows(self, ids: np.ndarray) -> np.ndarray:
+        """Gather full-precision rows by global row id"""
+        blocks = list(self._blocks())
+        starts = np.array([offset for offset, _ in blocks])
+        which = np.searchsorted(starts, ids, side="right") - 1
+        rows = np.empty((len(ids), self.dimension), dtype=np.float32)
+        for b in np.unique(which):
+            selected = which == b
+            offset, block = blocks[b]
+            rows[selected] = block[ids[selected] - offset]
+        return rows
+    
+    def _filtered_search(self, queries: np.ndarray, k: int, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k over the given (sorted) row ids only.
+        
+        Contiguous runs of rows (e.g. one uploaded document) are scored as a
+        slice of the block without copying; scattered rows are gathered first.
+        """
+        k = min(k, len(rows))
+        if k == 0:
+            return np.empty((len(queries), 0), np.float32), np.empty((len(queries), 0), np.int64)
+        
+        block_scores, block_ids = [], []
+        for offset, block in self._blocks():
+            lo, hi = np.searchsorted(rows, [offset, offset + len(block)])
+            local = rows[lo:hi] - offset
+            if len(local) == 0:
+                continue
+            if local[-1] - local[0] + 1 == len(local):
+                vectors = block[local[0]:local[-1] + 1]
+            else:
+                vectors = block[local]
+            scores, ids = top_k(queries @ vectors.T, k)
+            block_scores.append(scores)
+            block_ids.append(local[ids] + offset)
+        return merge_top_k(block_scores, block_ids, k)
+    
+    def _gather(self, ids: np.ndarray, scores: np.ndarray) -> Tuple[List[str], List[Dict], List[float]]:
+        """Materialize documents, metadatas and scores for row ids (id -1 = no hit)"""
+        hits = [(int(i), float(score)) for i, score in zip(ids, scores) if i >= 0]
+        documents = [self.chunks[i] for i, _ in hits]
+        tokens = self.metadata_index.column("tokens")
+        metadatas = [self.metadatas[i] if tokens[i] == MISSING else dict(self.metadatas[i], tokens=int(tokens[i]))
+                     for i, _ in hits]
+        return documents, metadatas, [score for _, score in hits]
+    
+    def _gather_with_rows(self, ids: np.ndarray, scores: np.ndarray):
+        """_gather plus the stored rows of the hits"""
+        hits = ids[ids >= 0]
+        return self._gather(ids, scores) + (self._take_rows(hits),)
+    
+    def _sync_index(self):
+        """The ANN index once it is ready, or None; the caller holds _lock.
         
-        similarities = cosine_similarity(query_embedding, self.embeddings)[0]
+        The index is loaded from disk or built in a background thread, and
+        searches use the exact scan until the thread hands it over. After
+        that, new rows are added inline, unless the backlog is large enough
+        to send the index back to the thread.
+        """
+        if self.index_type == "flat" or "index" in self._builds or "index" in self._failed_builds:
+            return None
+        if self.index is None:
+            index = create_index(self.index_type, self.dimension, self.index_params)
+            if index is None:
+                # FAISS unavailable: stay on exact search from now on
+                self.index_type = "flat"
+                return None
+            self._start_build("index", self._build_index, index)
+            return None
+        if len(self) - self.index.ntotal > INDEX_SYNC_ROWS:
+            self._start_build("index", self._build_index, self.index)
+            return None
+        self._add_unseen_rows(self.index)
+        return self.index
+    
+    def wait_for_index(self, timeout: Optional[float] = None) -> bool:
+        """Start any derived index the store uses and block until the builds finish.
         
-        # Get top k indices
-        if len(similarities) < k:
-            k = len(similarities)
+        Returns True if the ANN index or quantized codes (when configured) are ready.
+        """
+        with self._lock:
+            if len(self) > 0:
+                self._sync_index()
+                self._sync_sparse()
+                if self.quantization != "none":
+                    self._sync_quantized()
+            threads = list(self._builds.values())
+        for thread in threads:
+            thread.join(timeout)
+        with self._lock:
+            if self._builds:
+                return False
+            if self.index_type != "flat":
+                return self.index is not None
+            return self.quantization == "none" or self.quantized is not None
+    
+    def _start_build(self, attr: str, build, *args):
+        """Run build(*args) in a background thread and install its result as self.<attr>.
         
-        top_indices = np.argsort(similarities)[-k:][::-1]
+        The caller holds _lock. The attribute is None until the thread is
+        done, so searches fall back to the exact scan meanwhile. A build that
+        fails is not retried for the lifetime of the store.
+        """
+        setattr(self, attr, None)
+        generation = self._index_generation
         
-        # Return results
-        documents = [self.chunks[i] for i in top_indices]
-        metadatas = [self.metadatas[i] for i in top_indices]
-        scores = [float(similarities[i]) for i in top_indices]
+        def run():
+            try:
+                result = build(*args)
+            except Exception as e:
+                print(f"⚠️ Could not build the {attr} index, using exact search: {e}")
+                result = None
+                self._failed_builds.add(attr)
+            with self._lock:
+                # A compaction may have started a newer build of the same index
+                if self._builds.get(attr) is thread:
+                    del self._builds[attr]
+                if result is not None and generation == self._index_generation:
+                    setattr(self, attr, result)
         
-        return documents, metadatas, scores
+        thread = threading.Thread(target=run, daemon=True)
+        self._builds[attr] = thread
+        thread.start()
+    
+    def _build_index(self, index):
+        """Background thread: load the saved index if it still applies, then add the missing rows"""
+        if index.ntotal == 0:
+            self._load_index(index)
+        with self._lock:
+            blocks = list(self._blocks())
+        start, added = time.perf_counter(), len(self) - index.ntotal
+        self._add_unseen_rows(index, blocks)
+        if added > 0:
+            print(f"✓ Added {added} rows to the {self.index_type} index "
+                  f"in {time.perf_counter() - start:.1f}s")
+            self._save_index(index)
+        return index
     
-    def _save_to_disk(self):
-        """Save vector store to disk"""
+    def _load_index(self, index) -> bool:
+        """Load the saved index if it covers a prefix of the current segments"""
+        info = self.segment_store.read_index_info(self.index_type)
+        if info is None or info.get("params") != self.index_params:
+            return False
+        with self._lock:
+            names = [segment["name"] for segment in self.segment_store.segments]
+        if names[:len(info["segments"])] != info["segments"]:
+            return False
         try:
-            data = {
-                "embeddings": self.embeddings,
-                "metadatas": self.metadatas,
-                "chunks": self.chunks
-            }
-            with open(os.path.join(self.persist_dir, "vector_store.pkl"), 'wb') as f:
-                pickle.dump(data, f)
+            index.load(self.segment_store.index_paths(self.index_type)[0])
         except Exception as e:
-            print(f"⚠️ Could not save to disk: {e}")
+            print(f"⚠️ Could not load the saved {self.index_type} index: {e}")
+            index.reset()
+            return False
+        if index.ntotal != info["rows"]:
+            index.reset()
+            return False
+        self._index_saved_rows = index.ntotal
+        print(f"✓ Loaded {self.index_type} index with {index.ntotal} rows")
+        return True
     
-    def load_from_disk(self):
-        """Load vector store from disk"""
+    def _save_index(self, index):
+        """Save the index with the names of the segments whose rows it holds"""
+        with self._lock:
+            if self.read_only or not index.persistable or self.segment_store.total_rows != len(self):
+                return
+            names, rows = [], 0
+            for segment in self.segment_store.segments:
+                if rows + segment["rows"] > index.ntotal:
+                    break
+                names.append(segment["name"])
+                rows += segment["rows"]
+        if rows == 0 or rows != index.ntotal:
+            return
+        info = {"type": self.index_type, "params": self.index_params, "rows": rows, "segments": names}
+        try:
+            self.segment_store.save_index(index, self.index_type, info)
+            self._index_saved_rows = rows
+        except Exception as e:
+            print(f"⚠️ Could not save the {self.index_type} index: {e}")
+    
+    def _sync_quantized(self) -> Optional[QuantizedIndex]:
+        """The compressed codes once they are ready, or None; the caller holds _lock.
+        
+        Training and encoding run in a background thread (see _build_quantized)
+        like the ANN build; afterwards new rows are encoded inline.
+        """
+        if "quantized" in self._builds or "quantized" in self._failed_builds:
+            return None
+        if self.quantized is None:
+            self._start_build("quantized", self._build_quantized, QuantizedIndex(self.quantization, self.pq_m))
+            return None
+        if len(self) - self.quantized.ntotal > INDEX_SYNC_ROWS:
+            self._start_build("quantized", self._build_quantized, self.quantized)
+            return None
+        self._add_unseen_rows(self.quantized)
+        return self.quantized
+    
+    def _build_quantized(self, quantized: QuantizedIndex) -> QuantizedIndex:
+        """Background thread: load or train the quantizer, then load or encode each segment's codes.
+        
+        The trained quantizer and each segment's codes are saved, so a
+        reopened store neither retrains nor re-encodes.
+        """
+        with self._lock:
+            segments = list(self.segment_store.segments)
+            dimension = self.dimension
+        if not quantized.quantizer.is_trained:
+            state = self.segment_store.read_quantizer(self.quantization)
+            if state is None or not quantized.quantizer.set_state(state, dimension):
+                with self._lock:
+                    sample = self._training_sample()
+                quantized.quantizer.train(sample)
+                self._save_quantized(self.segment_store.save_quantizer, self.quantization,
+                                     quantized.quantizer.get_state())
+        
+        start = 0
+        for segment in segments:
+            end = start + segment["rows"]
+            if end > quantized.ntotal:
+                codes = self.segment_store.read_codes(segment, self.quantization, quantized.quantizer_id)
+                if codes is None:
+                    codes = quantized.encode(self.segment_store.open_embeddings(segment))
+                    self._save_quantized(self.segment_store.save_codes, segment,
+                                         self.quantization, codes, quantized.quantizer_id)
+                quantized.add_codes(codes[max(quantized.ntotal - start, 0):])
+            start = end
+        return quantized
+    
+    def _save_quantized(self, save, *args):
+        # Unsaved codes only cost a re-encode on the next open
+        if self.read_only:
+            return
         try:
-            path = os.path.join(self.persist_dir, "vector_store.pkl")
-            if os.path.exists(path):
-                with open(path, 'rb') as f:
-                    data = pickle.load(f)
-                    self.embeddings = data.get("embeddings")
-                    self.metadatas = data.get("metadatas", [])
-                    self.chunks = data.get("chunks", [])
-                print(f"✓ Loaded existing store with {len(self.chunks)} chunks")
-                return True
+            save(*args)
         except Exception as e:
-            print(f"⚠️ Could not load from disk: {e}")
-        return False
\ No newline at end of file
+            print(f"⚠️ Could not save quantized codes: {e}")
+    
+    def _training_sample(self) -> np.ndarray:
+        """Up to TRAIN_ROWS rows spread evenly over the whole store"""
+        ids = np.unique(np.linspace(0, len(self) - 1, min(TRAIN_ROWS, len(self))).astype(np.int64))
+        return self._take_rows(ids)
+    
+    def _sync_sparse(self) -> Optional[SparseIndex]:
+        """The BM25 index, caught up with any new rows, or None while it is built; the caller holds _lock"""
+        if "sparse" in self._builds:
+            return None
+        if self.sparse is None:
+            if "sparse" not in self._failed_builds:
+                self._start_build("sparse", self._build_sparse, SparseIndex())
+            return None
+        # Only rows committed between the build's snapshot and its hand-over
+        self._add_sparse_rows(self.sparse)
+        return self.sparse
+    
+    def _wait_for_sparse(self):
+        """Block, without holding _lock, until a background BM25 build is done"""
+        with self._lock:
+            thread = self._builds.get("sparse") if self._sync_sparse() is None else None
+        if thread is not None:
+            thread.join()
+    
+    def _ready_sparse(self) -> SparseIndex:
+        """The BM25 index for a query; the caller holds _lock and has waited for the build"""
+        sparse = self._sync_sparse()
+        if sparse is None:
+            # Only if the build failed, or a compaction restarted it after the wait
+            sparse = SparseIndex()
+            self._add_sparse_rows(sparse)
+            self.sparse = sparse
+        return sparse
+    
+    def _build_sparse(self, sparse: SparseIndex) -> SparseIndex:
+        """Background thread: load every segment's stored term counts into the index"""
+        with self._lock:
+            segments, chunks, n_rows = list(self.segment_store.segments), self.chunks, len(self)
+        start = time.perf_counter()
+        self._add_sparse_rows(sparse, segments, chunks, n_rows)
+        print(f"✓ Built BM25 index over {sparse.ntotal} chunks in {time.perf_counter() - start:.1f}s")
+        return sparse
+    
+    def _add_sparse_rows(self, sparse: SparseIndex, segments: Optional[List[Dict]] = None,
+                         chunks: Optional[ChunkStore] = None, n_rows: Optional[int] = None):
+        """Add the rows the BM25 index has not seen, up to n_rows.
+        
+        Stored term counts of the pending segments are stacked into one
+        block; segments saved before term counts existed are tokenized from
+        their text.
+        """
+        segments = self.segment_store.segments if segments is None else segments
+        chunks = self.chunks if chunks is None else chunks
+        n_rows = len(self) if n_rows is None else n_rows
+        pending, start = [], 0
+        for segment in segments:
+            end = start + segment["rows"]
+            if end > sparse.ntotal:
+                counts = self.segment_store.read_terms(segment)
+                if counts is None:
+                    break
+                pending.append(counts[max(sparse.ntotal - start, 0):])
+            start = end
+        if pending:
+            sparse.add_counts(sp.vstack(pending, format="csr"))
+        if sparse.ntotal < n_rows:
+            sparse.add(list(itertools.islice(chunks.iter_from(sparse.ntotal), n_rows - sparse.ntotal)))
+    
+    def _add_unseen_rows(self, index, blocks=None):
+        """Feed an index the rows it has not seen yet, in row order"""
+        for offset, block in (self._blocks() if blocks is None else blocks):
+            if offset + len(block) > index.ntotal:
+                index.add(block[index.ntotal - offset:])
+    
+    @staticmethod
+    def _normalize(embeddings: np.ndarray, inplace: bool = False) -> np.ndarray:
+        """L2-normalize rows as contiguous float32; zero rows stay zero"""
+        if not inplace:
+            embeddings = np.array(embeddings, dtype=np.float32, order="C")
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        embeddings /= norms
+        return embeddings
+    
+    @staticmethod
+    def _token_counts(metadatas: List[Dict], chunks: List[str]) -> np.ndarray:
+        """Each chunk's token count (a "tokens" metadata value is taken as given).
+        
+        Counted once at ingestion and kept in the tokens column, so context
+        budgets never tokenize at query time.
+        """
+        missing = [i for i, meta in enumerate(metadatas) if "tokens" not in meta]
+        tokens = np.array([meta.get("tokens", 0) for meta in metadatas], dtype=np.int32)
+        if missing:
+            tokens[missing] = count_tokens([chunks[i] for i in missing])
+        return tokens
+    
+    def _add_columns(self, segment: Dict, metadata_index: MetadataIndex):
+        """Append a segment's saved metadata columns to the index.
+        
+        Segments written before columns were saved are encoded once from
+        their metadata file. Token counts estimated without tiktoken are
+        recounted once tiktoken is available. Either way the columns are
+        saved back, unless the store is read-only.
+        """
+        columns = self.segment_store.read_columns(segment)
+        changed = columns is None
+        if columns is None:
+            metadatas = self.segment_store.read_metadatas(segment)
+            rows, info = MetadataIndex.encode(metadatas, self._token_counts(
+                metadatas, self.segment_store.read_chunks(segment)))
+            info["tokenizer"] = tokenizer_name()
+        else:
+            rows, info = columns
+        if info.get("tokenizer") != ENCODING_NAME and tokenizer_name() == ENCODING_NAME:
+            rows = np.array(rows)
+            rows[:, info["fields"].index("tokens")] = count_tokens(self.segment_store.read_chunks(segment))
+            info = dict(info, tokenizer=ENCODING_NAME)
+            changed = True
+        if changed and not self.read_only:
+            self.segment_store.save_columns(segment["name"], rows, info)
+        metadata_index.add_encoded(rows, info)
+    
+    def load_from_disk(self):
+        """Open the on-disk segments (embeddings are memory-mapped, not read).
+        
+        A store that exists but cannot be opened raises instead of silently
+        starting empty; an earlier version can be opened or restored instead.
+        """
+        if not self.segment_store.exists and not self.read_only:
+            self._migrate_pickle()
+        if not self.segment_store.exists and not self.read_only:
+            return False
+        
+        try:
+            for segment in self.segment_store.segments:
+                self.segments.append(self.segment_store.open_embeddings(segment))
+                self.chunks.add_part(self.segment_store.open_chunks(segment))
+                self.metadatas.add_part(self.segment_store.open_metadatas(segment))
+                self._add_columns(segment, self.metadata_index)
+            self.tombstones = self.segment_store.read_tombstones()
+        except (OSError, ValueError) as e:
+            raise RuntimeError(
+                f"Could not open version {self.segment_store.version} of {self.persist_dir}: {e}. "
+                f"Available versions: {self.segment_store.versions()}"
+            ) from e
+        if self.tombstones is not None:
+            self.n_deleted = int(self.tombstones.sum())
+        with self._lock:
+            self._start_build("sparse", self._build_sparse, SparseIndex())
+        print(f"✓ Loaded version {self.segment_store.version} with {len(self.chunks)} chunks")
+        return True
+    
+    def _migrate_pickle(self):
+        """Convert a legacy vector_store.pkl into the segment format"""
+        path = os.path.join(self.persist_dir, "vector_store.pkl")
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        embeddings = data.get("embeddings")
+        if embeddings is not None and len(embeddings) > 0:
+            self.segment_store.append(self._normalize(embeddings),
+                                      data.get("metadatas", []), data.get("chunks", []))
+        os.replace(path, path + ".migrated")
+        print("✓ Migrated vector_store.pkl to segment format")